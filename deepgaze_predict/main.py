@@ -1,58 +1,224 @@
 from deepgaze_pytorch import DeepGazeIIE
-from numpy import exp, load, array, save
+from functools import partial
+from numpy import exp, load, array, ndarray, stack
 from pathlib import Path
 from PIL import Image
 from scipy.ndimage import zoom
 from scipy.special import logsumexp
-from torch import tensor, FloatTensor, cuda, no_grad
-
-DEVICE = 'cuda'
-
-def predict(image_paths: list[Path], centerbias_path: Path, resolution: (int, int), output_name: str) -> None:
-    """
-    Predict the saliency map for a set of images using the DeepGazeIIE model. Rescales images to be the resolution
-    provided, in the order of (width, height). Notes that it requires the image input to be integer values between
-    0 and 255, and not normalized to 0-1. It will also require a centerbias which has been
-    """
-    numpy_resolution = (resolution[1], resolution[0])
-    with no_grad():
-        model = DeepGazeIIE(pretrained=True)
-        model.to(DEVICE)
-        model.eval()
-        cuda.empty_cache()
-        centerbias = load(centerbias_path)
-        shape_scaling = (numpy_resolution[0] / centerbias.shape[0], numpy_resolution[1] / centerbias.shape[1])
-        centerbias = zoom(centerbias, shape_scaling)
-        centerbias -= logsumexp(centerbias)
-        centerbias_tensor = tensor(centerbias).unsqueeze(0).to(DEVICE)
-        for image_path in image_paths:
-            output_path = Path(str(image_path).replace('images', output_name).replace('png', 'npy'))
-            image = Image.open(image_path)
-            image = image.resize(resolution, Image.Resampling.LANCZOS)
-            image_data = array(image)
-            image_tensor = tensor(image_data.transpose(2, 0, 1)).unsqueeze(0)
-            image_tensor = image_tensor.to(DEVICE)
-            prediction = model(image_tensor, centerbias_tensor)
-            detached_prediction = prediction.detach().cpu().squeeze().numpy()
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            save(output_path, detached_prediction)
-
-def predict_dataset(resolution: (int, int), output_name: str) -> None:
+from torch import Tensor, autocast, bfloat16, tensor, FloatTensor, cuda, no_grad, set_num_threads
+from typing import Optional
+from prediction_pipeline import BackgroundWriter, StageTimer, PredictionContainer, file_hash, load_resized, precision_output_name, prefetch, weights_hash
+
+DEVICE = 'cuda' if cuda.is_available() else 'cpu'
+PRECISIONS = ('float32', 'bfloat16')
+
+class DeepGazePredictor:
+    """
+    A DeepGazeIIE model which is constructed and loaded once, and then reused for every prediction. Images are run
+    through the model in batches, on any device (including the CPU). The time spent in each stage of predicting is
+    accumulated in `timer`. Predictions are keyed by a hash of the loaded weights so that outputs which are already
+    current can be skipped.
+    """
+    def __init__(self, device: str = DEVICE, batch_size: int = 4, threads: Optional[int] = None, decode_workers: int = 4, queue_depth: int = 8, precision: str = 'float32'):
+        """
+        Load the pretrained model onto the given device. Images are predicted `batch_size` at a time, and `threads`
+        sets the number of threads used for intra-op parallelism on the CPU (if None, the PyTorch default is kept).
+        When sweeping, `decode_workers` threads decode and resize images ahead of inference, and at most `queue_depth`
+        images (or batches awaiting writing) are held in memory.
+
+        `precision` is one of `PRECISIONS`, where 'bfloat16' runs the model under bfloat16 autocast. Outputs of a reduced
+        precision are named with the precision as a suffix, as in `precision_output_name`. There is no int8 mode, since
+        the backbones of DeepGazeIIE are read through forward hooks and cannot be traced for static quantization, and
+        dynamic quantization does not cover convolutions.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+        self.precision = precision
+        if threads is not None:
+            set_num_threads(threads)
+        self.device = device
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.queue_depth = queue_depth
+        self.timer = StageTimer()
+        self.model = DeepGazeIIE(pretrained=True)
+        self.model.to(device)
+        self.model.eval()
+        self.weights_hash = weights_hash(self.model)
+        if device.startswith('cuda'):
+            cuda.empty_cache()
+        self.centerbiases = {}
+
+    def centerbias_tensor(self, centerbias_path: Path, numpy_resolution: (int, int)) -> Tensor:
+        """
+        Load a centerbias rescaled to the given (height, width) resolution and normalized as a log density, as a
+        tensor of shape (1, height, width) on the model's device. Each centerbias is only prepared once.
+        """
+        key = (centerbias_path, numpy_resolution)
+        if key not in self.centerbiases:
+            centerbias = load(centerbias_path)
+            shape_scaling = (numpy_resolution[0] / centerbias.shape[0], numpy_resolution[1] / centerbias.shape[1])
+            centerbias = zoom(centerbias, shape_scaling)
+            centerbias -= logsumexp(centerbias)
+            self.centerbiases[key] = tensor(centerbias).unsqueeze(0).to(self.device)
+        return self.centerbiases[key]
+
+    def predict_arrays(self, image_data: ndarray, centerbias_path: Path) -> ndarray:
+        """
+        Predict the log density saliency maps of a batch of already resized images, given as an integer array of shape
+        (images, height, width, 3) with values between 0 and 255. A single centerbias tensor is broadcast over the batch.
+        Returns an array of shape (images, height, width).
+        """
+        numpy_resolution = image_data.shape[1:3]
+        with no_grad(), autocast(self.device.split(':')[0], dtype=bfloat16, enabled=self.precision == 'bfloat16'):
+            centerbias_tensor = self.centerbias_tensor(centerbias_path, numpy_resolution)
+            image_tensor = tensor(image_data.transpose(0, 3, 1, 2))
+            image_tensor = image_tensor.to(self.device)
+            prediction = self.model(image_tensor, centerbias_tensor.expand(len(image_data), -1, -1))
+            return prediction.detach().float().cpu().numpy().reshape(len(image_data), *numpy_resolution)
+
+    def predict_batch(self, images: list[Image.Image], centerbias_path: Path, resolution: (int, int)) -> ndarray:
+        """
+        Predict the log density saliency maps of a batch of images, each rescaled to be the resolution provided, in the
+        order of (width, height). A single centerbias tensor is broadcast over the batch. Returns an array of shape
+        (images, height, width).
+        """
+        image_data = stack([array(image.resize(resolution, Image.Resampling.LANCZOS)) for image in images])
+        return self.predict_arrays(image_data, centerbias_path)
+
+    def sweep(self, image_paths: list[Path], centerbias_path: Path, outputs: dict[tuple[int, int], str]) -> int:
+        """
+        Predict the saliency map for a set of images at several resolutions in a single traversal, where `outputs` maps
+        each resolution, in the order of (width, height), to its output name. Each image is decoded once and resized to
+        every resolution, and images are predicted in batches per resolution.
+
+        Decoding and resizing run ahead of inference in a pool of threads, and predictions are written by a background
+        thread, so that the three stages overlap. The time spent in each stage is added to `timer`.
+
+        Predictions are written to a `PredictionContainer` next to the `images` directory per output name (suffixed
+        with a reduced precision), in which row `i` holds the log density of image number `i + 1`. Each row is keyed by
+        the hash of its image, the hash of the weights, the resolution, the hash of the centerbias (the source of the
+        prior) and the precision, and rows whose key is unchanged are skipped, so that an interrupted sweep resumes where
+        it stopped. Returns the number of images predicted.
+        """
+        directory = image_paths[0].parent.parent
+        image_count = max(int(image_path.stem) for image_path in image_paths)
+        containers = {
+            resolution: PredictionContainer(directory, precision_output_name(output_name, self.precision), image_count, (resolution[1], resolution[0]))
+            for resolution, output_name in outputs.items()
+        }
+        with self.timer.time('hash', len(image_paths)):
+            image_hashes = { image_path: file_hash(image_path) for image_path in image_paths }
+            centerbias_hash = file_hash(centerbias_path)
+        keys = {
+            resolution: { image_path: [image_hashes[image_path], self.weights_hash, list(resolution), centerbias_hash, self.precision] for image_path in image_paths }
+            for resolution in containers
+        }
+        stale = {
+            image_path: [resolution for resolution, container in containers.items() if not container.is_current(int(image_path.stem), keys[resolution][image_path])]
+            for image_path in image_paths
+        }
+        image_paths = [image_path for image_path in image_paths if stale[image_path]]
+
+        def load(image_path: Path) -> dict:
+            return load_resized(image_path, stale[image_path], self.timer)
+
+        def predict_and_write(batch: list) -> None:
+            for resolution, container in containers.items():
+                batch_paths = [image_path for image_path, resized in batch if resolution in resized]
+                if not batch_paths:
+                    continue
+                with self.timer.time('inference', len(batch_paths)):
+                    predictions = self.predict_arrays(stack([resized[resolution] for _, resized in batch if resolution in resized]), centerbias_path)
+                rows = [int(image_path.stem) - 1 for image_path in batch_paths]
+                writer.submit(partial(container.write, rows, predictions, [keys[resolution][image_path] for image_path in batch_paths]))
+
+        with BackgroundWriter(self.queue_depth, self.timer) as writer:
+            batch = []
+            for image_path, resized in prefetch(load, image_paths, self.decode_workers, self.queue_depth):
+                batch.append((image_path, resized))
+                if len(batch) == self.batch_size:
+                    predict_and_write(batch)
+                    batch = []
+            if batch:
+                predict_and_write(batch)
+        return len(image_paths)
+
+    def predict(self, image_paths: list[Path], centerbias_path: Path, resolution: (int, int), output_name: str) -> int:
+        """
+        Predict the saliency map for a set of images using the DeepGazeIIE model. Rescales images to be the resolution
+        provided, in the order of (width, height). Notes that it requires the image input to be integer values between
+        0 and 255, and not normalized to 0-1. It also requires a centerbias, which is rescaled to the same resolution
+        and normalized as a log density (see `centerbias_tensor`).
+
+        Predictions are written to a `PredictionContainer` next to the `images` directory, named after `output_name`,
+        in which row `i` holds the log density of image number `i + 1`. All images share one resolution, so they are
+        predicted in batches which broadcast a single centerbias tensor. Images whose prediction is already current are
+        skipped, and the number of images predicted is returned.
+        """
+        return self.sweep(image_paths, centerbias_path, { resolution: output_name })
+
+def predict(image_paths: list[Path], centerbias_path: Path, resolution: (int, int), output_name: str, predictor: Optional[DeepGazePredictor] = None) -> None:
+    """
+    Predict the saliency map for a set of images using the DeepGazeIIE model, as in `DeepGazePredictor.predict`. A new
+    predictor is constructed unless one is given.
+    """
+    (predictor or DeepGazePredictor()).predict(image_paths, centerbias_path, resolution, output_name)
+
+def predict_dataset(resolution: (int, int), output_name: str, predictor: Optional[DeepGazePredictor] = None) -> None:
     """
     Predict the saliency map for all images in the dataset at `../data` using the DeepGazeIIE model. Rescales images to be the resolution
-    provided, in the order of (width, height).
+    provided, in the order of (width, height). The model is loaded once for the whole dataset, unless a predictor is given.
+    """
+    predictor = predictor or DeepGazePredictor()
+    for directory in Path("../data").iterdir():
+        image_paths = [ directory / "images" / f"{image_number}.png" for image_number in range(1, 101) ]
+        centerbias_path = directory / "centerbias_57.npy"
+        predictor.predict(image_paths, centerbias_path, resolution, output_name)
+
+def sweep_dataset(outputs: dict[tuple[int, int], str], predictor: Optional[DeepGazePredictor] = None) -> int:
+    """
+    Predict the saliency map for all images in the dataset at `../data` using the DeepGazeIIE model at several resolutions
+    in a single traversal of the dataset, as in `DeepGazePredictor.sweep`. Predictions which are already current are
+    skipped, and the number of images predicted is returned.
     """
+    predictor = predictor or DeepGazePredictor()
+    predicted = 0
     for directory in Path("../data").iterdir():
         image_paths = [ directory / "images" / f"{image_number}.png" for image_number in range(1, 101) ]
         centerbias_path = directory / "centerbias_57.npy"
-        predict(image_paths, centerbias_path, resolution, output_name)
+        predicted += predictor.sweep(image_paths, centerbias_path, outputs)
+    return predicted
+
+def predict_variants(outputs: dict[tuple[int, int], str], directory: Path = Path("../cache/variants"), centerbias_size: int = 57, predictor: Optional[DeepGazePredictor] = None) -> int:
+    """
+    Predict the saliency map for the transformations of the reference images rendered by `write_variants` of the
+    evaluation code, where each transformation is a directory under `directory` laid out like a directory of the
+    dataset. Each transformation is predicted with its own centerbias (`centerbias_{centerbias_size}.npy`, moved as the
+    transformation moves image content) as the prior, at several resolutions as in `sweep_dataset`, so that the
+    evaluation code can read the predictions of each output name back. Predictions which are already current are
+    skipped, and the number of images predicted is returned.
+    """
+    predictor = predictor or DeepGazePredictor()
+    predicted = 0
+    for variant_directory in sorted(directory.iterdir()):
+        image_paths = sorted((variant_directory / "images").glob("*.png"), key=lambda image_path: int(image_path.stem))
+        if image_paths:
+            predicted += predictor.sweep(image_paths, variant_directory / f"centerbias_{centerbias_size}.npy", outputs)
+    return predicted
 
-def predict_predefined_resolutions() -> None:
+def predict_predefined_resolutions(predictor: Optional[DeepGazePredictor] = None) -> None:
     """
     Predict the saliency map for all images in the dataset at `../data` using the DeepGazeIIE model for predefined resolutions.
+    Every image is decoded once for both resolutions, and the time spent in each stage is reported at the end.
     """
-    predict_dataset((1024, 576), "deepgaze_1024_576")
-    predict_dataset((1920, 1080), "deepgaze_1920_1080")
+    predictor = predictor or DeepGazePredictor()
+    predicted = sweep_dataset({
+        (1024, 576): "deepgaze_1024_576",
+        (1920, 1080): "deepgaze_1920_1080",
+    }, predictor)
+    print(f"Predicted {predicted} images, skipping those already current")
+    print(predictor.timer.report())
 
 if __name__ == "__main__":
-    predict_predefined_resolutions()
\ No newline at end of file
+    predict_predefined_resolutions()
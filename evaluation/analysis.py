@@ -0,0 +1,92 @@
+from dataset import Table
+from numpy import arange, bincount, concatenate, errstate, full, ndarray, sqrt, stack
+
+def grouped_mean(values: ndarray, groups: ndarray, group_count: int) -> ndarray:
+    """
+    Compute the mean of a flat array of values per group, given the group number of each
+    value. Groups without values have a mean of NaN.
+    """
+    with errstate(invalid='ignore', divide='ignore'):
+        return bincount(groups, weights=values, minlength=group_count) / bincount(groups, minlength=group_count)
+
+def grouped_zscores(values: ndarray, groups: ndarray, group_count: int) -> ndarray:
+    """
+    Compute the z-score of every value within its group, as `scipy.stats.zscore` does for the
+    values of each group alone (with the population standard deviation). Values of a group
+    without spread have a z-score of NaN.
+    """
+    deviations = values - grouped_mean(values, groups, group_count)[groups]
+    with errstate(invalid='ignore', divide='ignore'):
+        return deviations / sqrt(grouped_mean(deviations ** 2, groups, group_count))[groups]
+
+def grouped_linear_fits(x: ndarray, y: ndarray, groups: ndarray, group_count: int) -> tuple[ndarray, ndarray, ndarray, ndarray]:
+    """
+    Fit a line to the (x, y) points of every group by least squares, as `numpy.polyfit` with
+    a degree of 1 does for each group alone, and compute the Pearson correlation of each
+    group, as `numpy.corrcoef` does. Returns the number of points, correlation, slope and
+    intercept of each group, which are NaN for groups of fewer than two distinct points.
+    """
+    mean_x = grouped_mean(x, groups, group_count)
+    mean_y = grouped_mean(y, groups, group_count)
+    deviations_x = x - mean_x[groups]
+    deviations_y = y - mean_y[groups]
+    variance_x = grouped_mean(deviations_x ** 2, groups, group_count)
+    variance_y = grouped_mean(deviations_y ** 2, groups, group_count)
+    covariance = grouped_mean(deviations_x * deviations_y, groups, group_count)
+    with errstate(invalid='ignore', divide='ignore'):
+        correlation = covariance / sqrt(variance_x * variance_y)
+        slope = covariance / variance_x
+    return bincount(groups, minlength=group_count), correlation, slope, mean_y - slope * mean_x
+
+def pairwise_statistics(tables: dict[str, Table], pairs: list[tuple[str, str]], z_score_threshold: float = 3.0) -> dict[tuple[str, str], dict[str, Table]]:
+    """
+    Compute the statistics plotted by `visualization.pairwise_correlations` for several
+    (independent, dependent) pairs of columns at once, given tables of per-image correlation
+    metrics (such as those of `benchmark.correlation_metrics`) by model name.
+
+    Points are grouped by transformation and model, and points whose z-score within their
+    group is at or above the threshold in either column are dropped as outliers. A line is then
+    fitted to the remaining points of each group, and their correlation computed. Every pair,
+    transformation and model is computed in the same array operations, and groups may hold any
+    number of images.
+
+    Returns, for each pair, a table of the points kept under 'points' (with the columns
+    transformation, model, x and y), and a table of the fit of each group under 'fits' (with
+    the columns transformation, model, images, correlation, slope and intercept), with groups in
+    order of first appearance.
+    """
+    combined = Table(['transformation', 'model'], {
+        'transformation': concatenate([table.get_column('transformation') for table in tables.values()]),
+        'model': concatenate([full(len(table), model) for model, table in tables.items()]),
+    })
+    keys, group_numbers = combined.group_numbers('transformation', 'model')
+    group_count = len(keys)
+    # Lay the pairs side by side, with the groups of every pair numbered apart, so that all
+    # of them are computed as one flat array of groups
+    x = stack([concatenate([table.get_column(independent) for table in tables.values()]) for independent, _ in pairs]).astype(float)
+    y = stack([concatenate([table.get_column(dependent) for table in tables.values()]) for _, dependent in pairs]).astype(float)
+    groups = (group_numbers[None, :] + (arange(len(pairs)) * group_count)[:, None]).ravel()
+    kept = (grouped_zscores(x.ravel(), groups, len(pairs) * group_count) < z_score_threshold) & (grouped_zscores(y.ravel(), groups, len(pairs) * group_count) < z_score_threshold)
+    fits = grouped_linear_fits(x.ravel()[kept], y.ravel()[kept], groups[kept], len(pairs) * group_count)
+    kept = kept.reshape(x.shape)
+    images, correlation, slope, intercept = (fit.reshape(len(pairs), group_count) for fit in fits)
+
+    statistics = {}
+    for index, pair in enumerate(pairs):
+        statistics[pair] = {
+            'points': Table(['transformation', 'model', 'x', 'y'], {
+                'transformation': combined.get_column('transformation')[kept[index]],
+                'model': combined.get_column('model')[kept[index]],
+                'x': x[index][kept[index]],
+                'y': y[index][kept[index]],
+            }),
+            'fits': Table(['transformation', 'model', 'images', 'correlation', 'slope', 'intercept'], {
+                'transformation': [transformation for transformation, _ in keys],
+                'model': [model for _, model in keys],
+                'images': images[index],
+                'correlation': correlation[index],
+                'slope': slope[index],
+                'intercept': intercept[index],
+            }),
+        }
+    return statistics
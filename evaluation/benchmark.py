@@ -1,185 +1,571 @@
-from csv import DictReader
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from centerbias import centerbiases_for_transformations
-from dataset import directories, Table
-from metrics import CC, KL, NSS, IG, SSIM
-from numpy import mean, std, median, polyfit
+from dataset import directories, load_table, RowLog, Table
+from functools import partial
+from metrics import CC, KL, NSS, IG, SSIM, batched_IG, batched_NSS, pad_fixations, regularize
+from numpy import absolute, allclose, array, char, empty, float32, mean, ndarray, std, median, polyfit, stack
 from pathlib import Path
+from scipy.ndimage import zoom
 from scipy.stats import zscore
-from utilities import load_centerbias, load_image, load_saliency_map, load_fixations, get_transformation_name, load_real_saliency_map
+from transformations import Transformation, transformed_centerbias, transformed_fixations, variants_directory
+from typing import Any, Callable, Iterable, Iterator
+from utilities import SSIMStore, benchmark_input_paths, build_fixation_index, files_stamp, get_precision, set_precision, load_centerbias, load_image, load_saliency_map, load_fixations, get_transformation_name, load_real_saliency_map, loader_cache, rescale_fixations
 
-def fixation_point_averages(models: list[str], include_centerbias: bool = True, include_real: bool = True, centerbias_size: int = 57, logging: bool = False) -> Table:
+def map_work_units(function: Callable[[Any], Any], work_units: list[Any], workers: int = 1, chunksize: int = 1) -> Iterable[Any]:
     """
-    Run NSS and IG benchmarks for a set of provided model saliency maps, identified
-    by the name of the directory in which the saliency maps are stored. The IG metric
-    will compare against the centerbias of the given kernel size.
+    Apply `function` to each work unit, fanning out to a pool of `workers` processes
+    if more than one is requested. Results are yielded in the order of the work units,
+    regardless of the order in which they finish. The fixation index is opened before
+    the pool starts, so that workers never race to build it, and workers are set to the
+    same precision as this process.
+    """
+    if workers <= 1:
+        yield from map(function, work_units)
+        return
+    build_fixation_index()
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_precision, initargs=(get_precision(),)) as executor:
+        yield from executor.map(function, work_units, chunksize=chunksize)
+
+def reference_and_transformations() -> tuple[str, list[str]]:
+    """
+    Split the dataset directories into the reference directory and the list of
+    transformation directories.
+    """
+    transformations = []
+    reference_directory = None
+    for directory in directories:
+        if 'Reference' in directory:
+            reference_directory = directory
+        else:
+            transformations.append(directory)
+    return reference_directory, transformations
+
+def fixation_point_scores(models: list[str], centerbias_size: int, native_resolution: bool, work_unit: tuple[str, int]) -> tuple[ndarray, ndarray]:
+    """
+    Compute the NSS and IG scores of every model for one (directory, image number)
+    work unit, returned as two arrays ordered like `models`. If `native_resolution` is
+    set, model maps are scored at the resolution they were predicted at, against
+    rescaled fixations and a centerbias downsampled to the same grid.
+    """
+    directory, image_number = work_unit
+    centerbias = loader_cache.load(load_centerbias, directory, centerbias_size)
+    fixations = load_fixations(directory, image_number)
+    saliency_maps = []
+    for model in models:
+        if model == 'centerbias':
+            saliency_maps.append(centerbias)
+        elif model == 'real':
+            saliency_maps.append(load_real_saliency_map(directory, image_number))
+        else:
+            saliency_maps.append(load_saliency_map(directory, model, image_number, None if native_resolution else (1920, 1080)))
+    # Score every model sharing a resolution in one pass, shaped (models, 1 image)
+    groups = {}
+    for index, saliency_map in enumerate(saliency_maps):
+        groups.setdefault(saliency_map.shape, []).append(index)
+    nss = empty(len(models))
+    ig = empty(len(models))
+    for shape, indices in groups.items():
+        padded_fixations, mask = pad_fixations([rescale_fixations(fixations, shape)])
+        baseline = loader_cache.load(load_centerbias, directory, centerbias_size, shape)
+        group_maps = stack([saliency_maps[index] for index in indices])[:, None]
+        nss[indices] = batched_NSS(group_maps, padded_fixations, mask)[:, 0]
+        ig[indices] = batched_IG(group_maps, baseline, padded_fixations, mask)[:, 0]
+    return nss, ig
+
+score_headers = ['transformation', 'model', 'image_number', 'nss', 'ig']
+
+def fixation_score_rows(models: list[str], centerbias_size: int = 57, logging: bool = False, workers: int = 1, native_resolution: bool = False, row_log: RowLog | None = None) -> Iterator[dict]:
+    """
+    Yield the NSS and IG of every model on every image of every directory, as rows with the
+    columns of `score_headers`, as soon as each image is scored. If a row log is given, the
+    rows already in it are yielded first, only the images with rows missing from it are
+    scored, and each new row is appended to it before being yielded. A log should only be
+    shared between runs of the same `centerbias_size` and `native_resolution`.
+    """
+    if row_log is not None:
+        yield from row_log.rows()
+    work_units = [
+        (directory, image_number) for directory in directories for image_number in range(1, 101)
+        if row_log is None or any((get_transformation_name(directory), model, image_number) not in row_log for model in models)]
+    scores = map_work_units(partial(fixation_point_scores, models, centerbias_size, native_resolution), work_units, workers, chunksize=10)
+    for (directory, image_number), (nss, ig) in zip(work_units, scores):
+        for model, model_nss, model_ig in zip(models, nss, ig):
+            row = {
+                'transformation': get_transformation_name(directory),
+                'model': model,
+                'image_number': image_number,
+                'nss': model_nss,
+                'ig': model_ig}
+            if row_log is not None:
+                if row in row_log:
+                    continue
+                row_log.append(row)
+            yield row
+        if logging and image_number == 100:
+            print(f"Finished {get_transformation_name(directory)}")
+
+def average_score_rows(rows: Iterable[dict], transformations: list[str], models: list[str]) -> Table:
+    """
+    Summarize rows of per-image scores (see `score_headers`) by the mean, median and standard
+    deviation of NSS and IG per transformation and model, in the order given. Rows of any other
+    transformation or model are ignored. Only the scores are kept while reading the rows.
+    """
+    output = Table(['transformation', 'model', 'mean_nss', 'mean_ig', 'median_nss', 'median_ig', 'std_nss', 'std_ig'])
+    scores = { (transformation, model): { 'nss': [], 'ig': [] } for transformation in transformations for model in models }
+    for row in rows:
+        if (row['transformation'], row['model']) in scores:
+            scores[(row['transformation'], row['model'])]['nss'].append(float(row['nss']))
+            scores[(row['transformation'], row['model'])]['ig'].append(float(row['ig']))
+    for (transformation, model), model_scores in scores.items():
+        output.add_row({
+            'transformation': transformation,
+            'model': model,
+            'mean_nss': mean(model_scores['nss']),
+            'mean_ig': mean(model_scores['ig']),
+            'median_nss': median(model_scores['nss']),
+            'median_ig': median(model_scores['ig']),
+            'std_nss': std(model_scores['nss']),
+            'std_ig': std(model_scores['ig'])})
+    return output
+
+def checkpoint_tag(input_directories: list[str], models: list[str], centerbias_size: int, native_resolution: bool, image_numbers: range = range(1, 101), include_images: bool = False) -> dict:
+    """
+    Describe the models, parameters, precision and input files of a benchmark checkpoint, as
+    the tag of its row log, so that rows are not reused once any of them changes.
+    """
+    paths = [path for directory in input_directories for path in benchmark_input_paths(directory, models, centerbias_size, image_numbers, include_images)]
+    return {
+        'models': models,
+        'centerbias_size': centerbias_size,
+        'native_resolution': native_resolution,
+        'precision': getattr(get_precision(), '__name__', None),
+        'inputs': files_stamp(paths)}
+
+def open_row_log(checkpoint_path: str | None, headers: list[str], tag: Any = None) -> RowLog | nullcontext:
+    """
+    Open a row log at the given path, keyed by transformation, model and image number and
+    started again unless it was written under the same tag (see `checkpoint_tag`), or an
+    empty context if no path is given.
+    """
+    if checkpoint_path is None:
+        return nullcontext()
+    return RowLog(checkpoint_path, headers, ['transformation', 'model', 'image_number'], tag)
+
+def fixation_point_averages(models: list[str], include_centerbias: bool = True, include_real: bool = True, centerbias_size: int = 57, logging: bool = False, workers: int = 1, native_resolution: bool = False, checkpoint_path: str | None = None) -> Table:
+    """
+    Run NSS and IG benchmarks for a set of models, identified by the name of the directory
+    in which their saliency maps are stored, checkpointed per image if a checkpoint path is
+    given. Returns the averages per transformation and model.
     """
     if include_real:
         models += ['real']
     if include_centerbias:
         models += ['centerbias']
-    output = Table(['transformation', 'model', 'mean_nss', 'mean_ig', 'median_nss', 'median_ig', 'std_nss', 'std_ig'])
-    for directory in directories:
-        centerbias = load_centerbias(directory, centerbias_size)
-        for model in models:
-            data = { 'nss': [], 'ig': [] }
-            for image_number in range(1, 101):
-                fixations = load_fixations(directory, image_number)
-                if model == 'centerbias':
-                    saliency_map = centerbias
-                elif model == 'real':
-                    saliency_map = load_real_saliency_map(directory, image_number)
-                else:
-                    saliency_map = load_saliency_map(directory, model, image_number, (1920, 1080))
-                data['nss'].append(NSS(saliency_map, fixations))
-                data['ig'].append(IG(saliency_map, centerbias, fixations))
-            output.add_row({
+    tag = checkpoint_tag(directories, models, centerbias_size, native_resolution) if checkpoint_path is not None else None
+    with open_row_log(checkpoint_path, score_headers, tag) as row_log:
+        rows = fixation_score_rows(models, centerbias_size, logging, workers, native_resolution, row_log)
+        return average_score_rows(rows, [get_transformation_name(directory) for directory in directories], models)
+
+def all_fixation_point_averages(logging: bool = False, workers: int = 1, checkpoint_path: str | None = None) -> Table:
+    """
+    Run all fixation point benchmarks, checkpointing every image scored at the given path if
+    one is given.
+    """
+    return fixation_point_averages(['deepgaze_1024_576', 'deepgaze_1920_1080', 'unisal_384_224', 'unisal_384_288', 'unisal_384_216', 'unisal_1920_1080'], logging=logging, workers=workers, checkpoint_path=checkpoint_path)
+
+def variant_score_rows(transformations: list[Transformation], model: str, image_numbers: range = range(1, 101), centerbias_size: int = 57, logging: bool = False, row_log: RowLog | None = None, directory: str = variants_directory) -> Iterator[dict]:
+    """
+    Yield the NSS and IG of a model on transformations of the reference images, as rows with
+    the columns of `score_headers`, as soon as each variant is scored (see
+    `variant_fixation_averages`). If a row log is given, the rows already in it are yielded
+    first, variants with a row in it are not scored again, and each new row is appended to it
+    before being yielded.
+    """
+    if row_log is not None:
+        yield from row_log.rows()
+        transformations_left = [transformation for transformation in transformations if any((transformation.name, model, image_number) not in row_log for image_number in image_numbers)]
+    else:
+        transformations_left = transformations
+    centerbiases = { transformation.name: transformed_centerbias(transformation, centerbias_size) for transformation in transformations_left }
+    baselines = {}
+    for image_number in image_numbers:
+        for transformation in transformations_left:
+            fixations = transformed_fixations(transformation, image_number)
+            if len(fixations) > 0 and (row_log is None or (transformation.name, model, image_number) not in row_log):
+                saliency_map = load_saliency_map(f"{directory}/{transformation.name}", model, image_number, None)
+                yield variant_score_row(transformation, model, image_number, saliency_map, fixations, centerbiases, baselines, row_log)
+        if logging and transformations_left:
+            print(f"Finished image {image_number}")
+
+def variant_score_row(transformation: Transformation, model: str, image_number: int, saliency_map: ndarray, fixations: ndarray, centerbiases: dict, baselines: dict, row_log: RowLog | None) -> dict:
+    """
+    Score the saliency map predicted by a model for one transformed image, as a row of
+    `score_headers`, appending it to the row log if one is given. Baselines are the
+    centerbiases of the transformations rescaled to the shape of each prediction, and are added
+    as needed.
+    """
+    shape = saliency_map.shape
+    if (transformation.name, shape) not in baselines:
+        centerbias = centerbiases[transformation.name]
+        baselines[(transformation.name, shape)] = regularize(zoom(centerbias, (shape[0] / centerbias.shape[0], shape[1] / centerbias.shape[1]), order=1))
+    fixations = rescale_fixations(fixations, shape)
+    row = {
+        'transformation': transformation.name,
+        'model': model,
+        'image_number': image_number,
+        'nss': NSS(saliency_map, fixations),
+        'ig': IG(saliency_map, baselines[(transformation.name, shape)], fixations)}
+    if row_log is not None:
+        row_log.append(row)
+    return row
+
+def variant_fixation_averages(transformations: list[Transformation], model: str, image_numbers: range = range(1, 101), centerbias_size: int = 57, logging: bool = False, checkpoint_path: str | None = None, directory: str = variants_directory) -> Table:
+    """
+    Run NSS and IG benchmarks on the predictions of a model for the variants written by
+    `transformations.write_variants` and predicted by `predict_variants` of either predictor.
+    Returns the averages per transformation, in the format of `fixation_point_averages`.
+    """
+    variant_directories = [f"{directory}/{transformation.name}" for transformation in transformations]
+    tag = checkpoint_tag([directories[0], *variant_directories], [model], centerbias_size, True, image_numbers) if checkpoint_path is not None else None
+    with open_row_log(checkpoint_path, score_headers, tag) as row_log:
+        rows = variant_score_rows(transformations, model, image_numbers, centerbias_size, logging, row_log, directory)
+        return average_score_rows(rows, [transformation.name for transformation in transformations], [model])
+
+def correlation_work_units(transformations: list[str]) -> list[tuple[str, int]]:
+    """
+    List the (transformation directory, image number) work units of the correlation
+    benchmarks. Units are ordered by image first, so that consecutive units (and thus
+    the units of one worker's chunk) share the cached reference-side data of an image.
+    """
+    return [(transformation_directory, image_number) for image_number in range(1, 101) for transformation_directory in transformations]
+
+def image_pair_ssim(reference_directory: str, work_unit: tuple[str, int]) -> float:
+    """
+    Compute the SSIM between the reference image and the transformed image of a
+    (transformation directory, image number) work unit.
+    """
+    transformation_directory, image_number = work_unit
+    reference_image = loader_cache.load(load_image, reference_directory, image_number)
+    return SSIM(reference_image, load_image(transformation_directory, image_number))
+
+def update_ssim_store(ssim_store: SSIMStore | None = None, logging: bool = False, workers: int = 1) -> SSIMStore:
+    """
+    Compute the SSIM of every image pair which is missing from the SSIM store, or whose
+    images have changed since it was stored, and save the store. SSIM is model-independent,
+    so after the first run this computes nothing, nor reads any image. Pairs are computed in
+    a pool of `workers` processes if more than one is requested.
+    """
+    ssim_store = ssim_store or SSIMStore()
+    reference_directory, transformations = reference_and_transformations()
+    stale_pairs = ssim_store.stale_pairs(reference_directory, transformations)
+    work_units = [(transformation_directory, image_number) for transformation_directory, image_number, _, _ in stale_pairs]
+    results = map_work_units(partial(image_pair_ssim, reference_directory), work_units, workers, chunksize=len(transformations))
+    for (transformation_directory, image_number, reference_hash, transformed_hash), ssim in zip(stale_pairs, results):
+        ssim_store.record(transformation_directory, image_number, reference_hash, transformed_hash, ssim)
+    if stale_pairs or ssim_store.image_hashes_changed:
+        ssim_store.save()
+    if logging:
+        print(f"Computed SSIM for {len(stale_pairs)} image pairs")
+    return ssim_store
+
+def correlation_rows(model: str, reference_directory: str, include_loss: bool, ssim_store: SSIMStore, native_resolution: bool, work_unit: tuple[str, int]) -> tuple[dict[str, float], dict[str, float] | None]:
+    """
+    Compute one row of the performance correlation metrics and, if `include_loss` is set,
+    one row of the loss correlation metrics for a (transformation directory, image number)
+    work unit. Both rows share every load and every metric they have in common, and SSIM is
+    looked up in the given store rather than computed. If `native_resolution` is set, the
+    model maps are compared with each other at their predicted resolution, and scored against
+    rescaled fixations and centerbiases downsampled to the same grid.
+    """
+    transformation_directory, image_number = work_unit
+    resolution = None if native_resolution else (1920, 1080)
+    reference_centerbias = loader_cache.load(load_centerbias, reference_directory, 57)
+    reference_saliency_map = loader_cache.load(load_saliency_map, reference_directory, model, image_number, resolution)
+    reference_fixations = loader_cache.load(load_fixations, reference_directory, image_number)
+    transformation_centerbias = loader_cache.load(load_centerbias, transformation_directory, 57)
+    ssim = ssim_store.ssim(transformation_directory, image_number)
+    transformed_saliency_map = load_saliency_map(transformation_directory, model, image_number, resolution)
+    cc = CC(transformed_saliency_map, reference_saliency_map)
+    kl = KL(reference_saliency_map, transformed_saliency_map)
+    transformed_fixations = load_fixations(transformation_directory, image_number)
+    shape = reference_saliency_map.shape
+    reference_model_fixations = rescale_fixations(reference_fixations, shape)
+    transformed_model_fixations = rescale_fixations(transformed_fixations, shape)
+    reference_nss = NSS(reference_saliency_map, reference_model_fixations)
+    reference_ig = IG(reference_saliency_map, loader_cache.load(load_centerbias, reference_directory, 57, shape), reference_model_fixations)
+    transformed_nss = NSS(transformed_saliency_map, transformed_model_fixations)
+    transformed_ig = IG(transformed_saliency_map, loader_cache.load(load_centerbias, transformation_directory, 57, shape), transformed_model_fixations)
+    performance_row = {
+        'transformation': get_transformation_name(transformation_directory),
+        'image_number': image_number,
+        'ssim': ssim,
+        'cc': cc,
+        'kl': kl,
+        'reference_nss': reference_nss,
+        'reference_ig': reference_ig,
+        'transformed_nss': transformed_nss,
+        'transformed_ig': transformed_ig}
+    if not include_loss:
+        return performance_row, None
+
+    real_reference_saliency_map = loader_cache.load(load_real_saliency_map, reference_directory, image_number)
+    real_transformed_saliency_map = load_real_saliency_map(transformation_directory, image_number)
+    real_reference_nss = NSS(real_reference_saliency_map, reference_fixations)
+    real_reference_ig = IG(real_reference_saliency_map, reference_centerbias, reference_fixations)
+    centerbias_reference_nss = NSS(reference_centerbias, reference_fixations)
+    centerbias_reference_ig = 0
+    real_transformed_nss = NSS(real_transformed_saliency_map, transformed_fixations)
+    real_transformed_ig = IG(real_transformed_saliency_map, transformation_centerbias, transformed_fixations)
+    centerbias_transformed_nss = NSS(transformation_centerbias, transformed_fixations)
+    centerbias_transformed_ig = 0
+
+    normalized_reference_nss = (reference_nss - centerbias_reference_nss) / (real_reference_nss - centerbias_reference_nss)
+    normalized_reference_ig = (reference_ig - centerbias_reference_ig) / (real_reference_ig - centerbias_reference_ig)
+    normalized_transformed_nss = (transformed_nss - centerbias_transformed_nss) / (real_transformed_nss - centerbias_transformed_nss)
+    normalized_transformed_ig = (transformed_ig - centerbias_transformed_ig) / (real_transformed_ig - centerbias_transformed_ig)
+
+    loss_nss = normalized_reference_nss - normalized_transformed_nss
+    loss_ig = normalized_reference_ig - normalized_transformed_ig
+
+    loss_row = {
+        'transformation': performance_row['transformation'],
+        'image_number': image_number,
+        'ssim': ssim,
+        'cc': cc,
+        'kl': kl,
+        'reference_nss': reference_nss,
+        'reference_ig': reference_ig,
+        'loss_nss': loss_nss,
+        'loss_ig': loss_ig}
+    return performance_row, loss_row
+
+performance_headers = ['transformation', 'image_number', 'ssim', 'cc', 'kl', 'reference_nss', 'reference_ig', 'transformed_nss', 'transformed_ig']
+loss_headers = ['transformation', 'image_number', 'ssim', 'cc', 'kl', 'reference_nss', 'reference_ig', 'loss_nss', 'loss_ig']
+
+def correlation_row_headers(include_loss: bool) -> list[str]:
+    """
+    The columns of the rows yielded by `correlation_metric_rows`: those of the performance
+    table, with the model, and those of the loss table if `include_loss` is set.
+    """
+    headers = ['transformation', 'model', *performance_headers[1:]]
+    if include_loss:
+        headers += ['loss_nss', 'loss_ig']
+    return headers
+
+def correlation_metric_rows(model: str, logging: bool = False, workers: int = 1, include_loss: bool = True, native_resolution: bool = False, row_log: RowLog | None = None) -> Iterator[dict]:
+    """
+    Yield the correlation metrics of a model for every (transformation, image) pair, as rows
+    with the columns of `correlation_row_headers`, as soon as each pair is computed (see
+    `correlation_rows`). SSIM is taken from the SSIM store, which is first brought up to date.
+    If a row log is given, the rows of the model already in it are yielded first, only pairs
+    missing from it are computed, and each new row is appended to it before being yielded. A
+    log should only be shared between runs of the same `native_resolution`.
+    """
+    ssim_store = update_ssim_store(logging=logging, workers=workers)
+    reference_directory, transformations = reference_and_transformations()
+    if row_log is not None:
+        yield from (row for row in row_log.rows() if row['model'] == model)
+    work_units = [
+        (transformation_directory, image_number) for transformation_directory, image_number in correlation_work_units(transformations)
+        if row_log is None or (get_transformation_name(transformation_directory), model, image_number) not in row_log]
+    results = map_work_units(partial(correlation_rows, model, reference_directory, include_loss, ssim_store, native_resolution), work_units, workers, chunksize=len(transformations))
+    for (transformation_directory, image_number), (performance_row, loss_row) in zip(work_units, results):
+        row = { 'model': model, **performance_row, **(loss_row or {}) }
+        if row_log is not None:
+            row_log.append(row)
+        yield row
+        if logging and transformation_directory == transformations[-1]:
+            print(f"Finished image {image_number}")
+
+def correlation_metrics(model: str, logging: bool = False, workers: int = 1, include_loss: bool = True, include_averages: bool = False, native_resolution: bool = False, checkpoint_path: str | None = None) -> dict[str, Table]:
+    """
+    Compute the performance and, if `include_loss` is set, loss correlation metrics of a model
+    in one sweep, checkpointed per image pair if a checkpoint path is given. Returns the tables
+    under 'performance' and 'loss' (and per-transformation averages under 'averages').
+    """
+    reference_directory, transformations = reference_and_transformations()
+    names = [get_transformation_name(transformation_directory) for transformation_directory in transformations]
+    # Rows arrive ordered by image (with any resumed rows first), so collect their scalars to order the tables by transformation
+    rows = { name: {} for name in names }
+    tag = checkpoint_tag(directories, [model, 'real'], 57, native_resolution, include_images=True) if checkpoint_path is not None else None
+    with open_row_log(checkpoint_path, correlation_row_headers(include_loss), tag) as row_log:
+        for row in correlation_metric_rows(model, logging, workers, include_loss, native_resolution, row_log):
+            if row['transformation'] in rows:
+                rows[row['transformation']][row['image_number']] = row
+    ordered_rows = [rows[name][image_number] for name in names for image_number in sorted(rows[name])]
+
+    tables = { 'performance': Table(performance_headers) }
+    for row in ordered_rows:
+        tables['performance'].add_row(row)
+    if include_loss:
+        tables['loss'] = Table(loss_headers)
+        for row in ordered_rows:
+            tables['loss'].add_row(row)
+    if include_averages:
+        tables['averages'] = Table(['transformation', 'model', 'mean_nss', 'mean_ig', 'median_nss', 'median_ig', 'std_nss', 'std_ig'])
+        # The reference scores are repeated in the rows of every transformation, so take them from the first
+        reference_rows = [rows[names[0]][image_number] for image_number in sorted(rows[names[0]])]
+        scores = [(reference_directory, [row['reference_nss'] for row in reference_rows], [row['reference_ig'] for row in reference_rows])]
+        for transformation_directory, name in zip(transformations, names):
+            transformation_rows = [rows[name][image_number] for image_number in sorted(rows[name])]
+            scores.append((transformation_directory, [row['transformed_nss'] for row in transformation_rows], [row['transformed_ig'] for row in transformation_rows]))
+        for directory, nss, ig in scores:
+            tables['averages'].add_row({
                 'transformation': get_transformation_name(directory),
                 'model': model,
-                'mean_nss': mean(data['nss']),
-                'mean_ig': mean(data['ig']),
-                'median_nss': median(data['nss']),
-                'median_ig': median(data['ig']),
-                'std_nss': std(data['nss']),
-                'std_ig': std(data['ig'])})
-            if logging:
-                print(f"Finished {model} for {get_transformation_name(directory)}")
-    return output
+                'mean_nss': mean(nss),
+                'mean_ig': mean(ig),
+                'median_nss': median(nss),
+                'median_ig': median(ig),
+                'std_nss': std(nss),
+                'std_ig': std(ig)})
+    if logging:
+        print(f"Loader cache: {loader_cache}")
+    return tables
 
-def all_fixation_point_averages(logging: bool = False) -> Table:
+def performance_correlation_metrics(model: str, logging: bool = False, workers: int = 1) -> Table:
     """
-    Run all fixation point benchmarks.
+    Compute the correlation metrics (as described in section 4 of the readme) for a given model.
+    Work units are computed in a pool of `workers` processes if more than one is requested.
     """
-    return fixation_point_averages(['deepgaze_1024_576', 'deepgaze_1920_1080', 'unisal_384_224', 'unisal_384_288', 'unisal_384_216', 'unisal_1920_1080'], logging=logging)
+    return correlation_metrics(model, logging, workers, include_loss=False)['performance']
 
-def performance_correlation_metrics(model: str, logging: bool = False) -> Table:
+def loss_correlation_metrics(model: str, logging: bool = False, workers: int = 1) -> Table:
     """
     Compute the correlation metrics (as described in section 4 of the readme) for a given model.
+    Work units are computed in a pool of `workers` processes if more than one is requested.
     """
-    output = Table(['transformation', 'image_number', 'ssim', 'cc', 'kl', 'reference_nss', 'reference_ig', 'transformed_nss', 'transformed_ig'])
-    transformations = []
-    reference_directory = None
-    for directory in directories:
-        if 'Reference' in directory:
-            reference_directory = directory
-        else:
-            transformations.append(directory)
-    for transformation_directory in transformations:
-        transformation_centerbias = load_centerbias(transformation_directory, 57)
-        reference_centerbias = load_centerbias(reference_directory, 57)
-        for image_number in range(1, 101):
-            transformation = get_transformation_name(transformation_directory)
-            transformed_image = load_image(transformation_directory, image_number)
-            reference_image = load_image(reference_directory, image_number)
-            ssim = SSIM(reference_image, transformed_image)
-            transformed_saliency_map = load_saliency_map(transformation_directory, model, image_number, (1920, 1080))
-            reference_saliency_map = load_saliency_map(reference_directory, model, image_number, (1920, 1080))
-            cc = CC(transformed_saliency_map, reference_saliency_map)
-            kl = KL(reference_saliency_map, transformed_saliency_map)
-            reference_fixations = load_fixations(reference_directory, image_number)
-            transformed_fixations = load_fixations(transformation_directory, image_number)
-            reference_nss = NSS(reference_saliency_map, reference_fixations)
-            reference_ig = IG(reference_saliency_map, reference_centerbias, reference_fixations)
-            transformed_nss = NSS(transformed_saliency_map, transformed_fixations)
-            transformed_ig = IG(transformed_saliency_map, transformation_centerbias, transformed_fixations)
+    return correlation_metrics(model, logging, workers)['loss']
+
+def native_resolution_report(model: str, logging: bool = False, workers: int = 1) -> Table:
+    """
+    Report the numerical difference between evaluating a model at 1920x1080 and at the
+    resolution it was predicted at, per transformation and per metric.
+    """
+    full_table = performance_correlation_metrics(model, logging, workers)
+    native_table = correlation_metrics(model, logging, workers, include_loss=False, native_resolution=True)['performance']
+    output = Table(['transformation', 'metric', 'mean_full', 'mean_native', 'mean_absolute_difference', 'max_absolute_difference'])
+    native_groups = native_table.group_by('transformation')
+    for transformation, full_rows in full_table.group_by('transformation').items():
+        for metric in ['cc', 'kl', 'reference_nss', 'reference_ig', 'transformed_nss', 'transformed_ig']:
+            full = full_rows.get_column(metric)
+            native = native_groups[transformation].get_column(metric)
             output.add_row({
                 'transformation': transformation,
-                'image_number': image_number,
-                'ssim': ssim,
-                'cc': cc,
-                'kl': kl,
-                'reference_nss': reference_nss,
-                'reference_ig': reference_ig,
-                'transformed_nss': transformed_nss,
-                'transformed_ig': transformed_ig})
-        if logging:
-            print(f"Finished {transformation}")
+                'metric': metric,
+                'mean_full': mean(full),
+                'mean_native': mean(native),
+                'mean_absolute_difference': mean(absolute(full - native)),
+                'max_absolute_difference': absolute(full - native).max()})
     return output
 
-def loss_correlation_metrics(model: str, logging: bool = False) -> Table:
+def precision_drift(model: str, precision: str, logging: bool = False, workers: int = 1, tolerance: float | None = None, checkpoint_path: str | None = None) -> Table:
     """
-    Compute the correlation metrics (as described in section 4 of the readme) for a given model.
+    Report how far the NSS and IG of a model predicted at a reduced precision (such as
+    'int8' or 'bfloat16', stored under the model name with the precision as a suffix, e.g.
+    `unisal_384_224_int8`) drift from those of its float32 predictions. Both are scored at
+    their predicted resolution, and the mean and largest absolute drift per image are
+    reported per transformation. If a tolerance is given, a ValueError is raised when the
+    largest drift of either metric exceeds it. If a checkpoint path is given, per-image scores
+    are checkpointed there as in `fixation_point_averages`.
     """
-    output = Table(['transformation', 'image_number', 'ssim', 'cc', 'kl', 'reference_nss', 'reference_ig', 'loss_nss', 'loss_ig'])
-    transformations = []
-    reference_directory = None
+    candidate = f"{model}_{precision}"
+    output = Table(['transformation', 'model', 'precision', 'mean_nss', 'candidate_mean_nss', 'mean_ig', 'candidate_mean_ig', 'mean_nss_drift', 'mean_ig_drift', 'max_nss_drift', 'max_ig_drift'])
+    scores = { get_transformation_name(directory): {} for directory in directories }
+    tag = checkpoint_tag(directories, [model, candidate], 57, True) if checkpoint_path is not None else None
+    with open_row_log(checkpoint_path, score_headers, tag) as row_log:
+        for row in fixation_score_rows([model, candidate], 57, False, workers, True, row_log):
+            if row['transformation'] in scores and row['model'] in (model, candidate):
+                scores[row['transformation']].setdefault(row['image_number'], {})[row['model']] = (float(row['nss']), float(row['ig']))
     for directory in directories:
-        if 'Reference' in directory:
-            reference_directory = directory
-        else:
-            transformations.append(directory)
-    for transformation_directory in transformations:
-        transformation_centerbias = load_centerbias(transformation_directory, 57)
-        reference_centerbias = load_centerbias(reference_directory, 57)
-        for image_number in range(1, 101):
-            transformation = get_transformation_name(transformation_directory)
-            transformed_image = load_image(transformation_directory, image_number)
-            reference_image = load_image(reference_directory, image_number)
-            ssim = SSIM(reference_image, transformed_image)
-            transformed_saliency_map = load_saliency_map(transformation_directory, model, image_number, (1920, 1080))
-            reference_saliency_map = load_saliency_map(reference_directory, model, image_number, (1920, 1080))
-            real_transformed_saliency_map = load_real_saliency_map(transformation_directory, image_number)
-            real_reference_saliency_map = load_real_saliency_map(reference_directory, image_number)
-            cc = CC(transformed_saliency_map, reference_saliency_map)
-            kl = KL(reference_saliency_map, transformed_saliency_map)
-            reference_fixations = load_fixations(reference_directory, image_number)
-            transformed_fixations = load_fixations(transformation_directory, image_number)
-
-            reference_nss = NSS(reference_saliency_map, reference_fixations)
-            reference_ig = IG(reference_saliency_map, reference_centerbias, reference_fixations)
-            real_reference_nss = NSS(real_reference_saliency_map, reference_fixations)
-            real_reference_ig = IG(real_reference_saliency_map, reference_centerbias, reference_fixations)
-            centerbias_reference_nss = NSS(reference_centerbias, reference_fixations)
-            centerbias_reference_ig = 0
-            transformed_nss = NSS(transformed_saliency_map, transformed_fixations)
-            transformed_ig = IG(transformed_saliency_map, transformation_centerbias, transformed_fixations)
-            real_transformed_nss = NSS(real_transformed_saliency_map, transformed_fixations)
-            real_transformed_ig = IG(real_transformed_saliency_map, transformation_centerbias, transformed_fixations)
-            centerbias_transformed_nss = NSS(transformation_centerbias, transformed_fixations)
-            centerbias_transformed_ig = 0
-
-            normalized_reference_nss = (reference_nss - centerbias_reference_nss) / (real_reference_nss - centerbias_reference_nss)
-            normalized_reference_ig = (reference_ig - centerbias_reference_ig) / (real_reference_ig - centerbias_reference_ig)
-            normalized_transformed_nss = (transformed_nss - centerbias_transformed_nss) / (real_transformed_nss - centerbias_transformed_nss)
-            normalized_transformed_ig = (transformed_ig - centerbias_transformed_ig) / (real_transformed_ig - centerbias_transformed_ig)
-
-            loss_nss = normalized_reference_nss - normalized_transformed_nss
-            loss_ig = normalized_reference_ig - normalized_transformed_ig
-
-            output.add_row({
-                'transformation': transformation,
-                'image_number': image_number,
-                'ssim': ssim,
-                'cc': cc,
-                'kl': kl,
-                'reference_nss': reference_nss,
-                'reference_ig': reference_ig,
-                'loss_nss': loss_nss,
-                'loss_ig': loss_ig})
-        if logging:
-            print(f"Finished {transformation}")
+        image_scores = scores[get_transformation_name(directory)]
+        pairs = array([[image_scores[image_number][model], image_scores[image_number][candidate]] for image_number in sorted(image_scores)])
+        nss = pairs[:, :, 0]
+        ig = pairs[:, :, 1]
+        nss_drift = absolute(nss[:, 1] - nss[:, 0])
+        ig_drift = absolute(ig[:, 1] - ig[:, 0])
+        output.add_row({
+            'transformation': get_transformation_name(directory),
+            'model': model,
+            'precision': precision,
+            'mean_nss': mean(nss[:, 0]),
+            'candidate_mean_nss': mean(nss[:, 1]),
+            'mean_ig': mean(ig[:, 0]),
+            'candidate_mean_ig': mean(ig[:, 1]),
+            'mean_nss_drift': mean(nss_drift),
+            'mean_ig_drift': mean(ig_drift),
+            'max_nss_drift': nss_drift.max(),
+            'max_ig_drift': ig_drift.max()})
+    max_nss_drift = max(output.get_column('max_nss_drift'))
+    max_ig_drift = max(output.get_column('max_ig_drift'))
+    if logging:
+        print(f"{candidate}: largest NSS drift {max_nss_drift:.4g}, largest IG drift {max_ig_drift:.4g}")
+    if tolerance is not None and max(max_nss_drift, max_ig_drift) > tolerance:
+        raise ValueError(f"{candidate} drifts from {model} by more than {tolerance} (NSS {max_nss_drift:.4g}, IG {max_ig_drift:.4g})")
     return output
 
+def check_against_csv(table: Table, csv_path: str, tolerance: float = 1e-4) -> None:
+    """
+    Check that every numeric column of a table matches a previously saved CSV file (such as
+    those in `../results`) within a relative tolerance, for instance to confirm that evaluating
+    with `set_precision(float32)` reproduces the published results. Raises a ValueError listing
+    the columns which do not match.
+    """
+    expected = load_table(csv_path)
+    mismatches = []
+    for column in table.data.keys():
+        try:
+            actual_values = array(table.get_column(column), dtype=float)
+            expected_values = array(expected.get_column(column), dtype=float)
+        except ValueError:
+            continue
+        if actual_values.shape != expected_values.shape:
+            mismatches.append(f"{column} (expected {len(expected_values)} rows, found {len(actual_values)})")
+        elif not allclose(actual_values, expected_values, rtol=tolerance, atol=tolerance):
+            mismatches.append(f"{column} (largest difference {absolute(actual_values - expected_values).max():.3g})")
+    if mismatches:
+        raise ValueError(f"Table does not match {csv_path} within {tolerance}: {', '.join(mismatches)}")
 
-loss_correlation_metrics("unisal_384_224", logging=True).to_csv(output_path="unisal_benchmark.csv")
+def check_float32_results(results_directory: str = "../results", tolerance: float = 1e-4, logging: bool = False, workers: int = 1) -> None:
+    """
+    Recompute the published results with every map evaluated in float32 (see `set_precision`)
+    and check them with `check_against_csv` against the CSV files in the results directory: the
+    fixation point averages against `all_performance_averages.csv`, and the performance and loss
+    correlation metrics of both models against `{deepgaze,unisal}_correlation_metrics.csv` and
+    `{deepgaze,unisal}_loss_correlation_metrics.csv`. Every table is checked before a ValueError
+    listing all mismatches is raised, and the previous precision is restored afterwards.
+    """
+    previous_precision = get_precision()
+    set_precision(float32)
+    mismatches = []
+    try:
+        checks = [(all_fixation_point_averages(logging, workers), f"{results_directory}/all_performance_averages.csv")]
+        for model, name in [("deepgaze_1024_576", "deepgaze"), ("unisal_384_224", "unisal")]:
+            tables = correlation_metrics(model, logging, workers)
+            checks.append((tables['performance'], f"{results_directory}/{name}_correlation_metrics.csv"))
+            checks.append((tables['loss'], f"{results_directory}/{name}_loss_correlation_metrics.csv"))
+        for table, csv_path in checks:
+            try:
+                check_against_csv(table, csv_path, tolerance)
+                if logging:
+                    print(f"{csv_path} matches in float32 within {tolerance}")
+            except ValueError as error:
+                mismatches.append(str(error))
+    finally:
+        set_precision(previous_precision)
+    if mismatches:
+        raise ValueError("\n".join(mismatches))
 
 def best_resolution_unisal(csv_path: str) -> None:
     """
     Find the best resolution for the UNISAL model, given a csv file of benchmark results.
     """
-    NSS = {}
-    IG = {}
-    with open(csv_path, 'r', newline='') as csvfile:
-        reader = DictReader(csvfile)
-        for row in reader:
-            if row['model'].startswith('unisal'):
-                if row['model'] not in NSS:
-                    NSS[row['model']] = { 'mean': [], 'median': [], 'std': [] }
-                    IG[row['model']] = { 'mean': [], 'median': [], 'std': [] }
-                NSS[row['model']]['mean'].append(float(row['mean_nss']))
-                NSS[row['model']]['median'].append(float(row['median_nss']))
-                NSS[row['model']]['std'].append(float(row['std_nss']))
-                IG[row['model']]['mean'].append(float(row['mean_ig']))
-                IG[row['model']]['median'].append(float(row['median_ig']))
-                IG[row['model']]['std'].append(float(row['std_ig']))
-    for model in NSS:
-        print(model, mean(NSS[model]['mean']), mean(IG[model]['mean']), mean(NSS[model]['median']), mean(IG[model]['median']), mean(NSS[model]['std']), mean(IG[model]['std']))
+    table = load_table(csv_path)
+    unisal_rows = table.select(char.startswith(table.get_column('model'), 'unisal'))
+    for model, rows in unisal_rows.group_by('model').items():
+        print(model, *(mean(rows.get_column(column)) for column in ['mean_nss', 'mean_ig', 'median_nss', 'median_ig', 'std_nss', 'std_ig']))
+
+
+if __name__ == "__main__":
+    loss_correlation_metrics("unisal_384_224", logging=True).to_csv(output_path="unisal_benchmark.csv")
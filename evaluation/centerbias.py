@@ -1,8 +1,10 @@
 from PIL import Image
+from json import dump, load
 from pathlib import Path
 from numpy import float32, uint8, save, ndarray
+from prediction_pipeline import atomic_write
 from scipy.ndimage import gaussian_filter
-from utilities import load_fixation_map
+from utilities import file_hash, load_fixation_map
 from dataset import directories
 
 
@@ -27,15 +29,42 @@ def estimate_centerbias(directory_path: str, sigma: float = 1.0) -> ndarray:
     
     return centerbias
 
+def centerbias_manifest(directory_path: str, sigma: float) -> dict:
+    """
+    Describe the inputs a centerbias is estimated from: the kernel size and a content hash of
+    each fixation map of the directory.
+    """
+    return {
+        "sigma": sigma,
+        "fixations": [file_hash(f"{directory_path}/fixations/{image_number}.png") for image_number in range(1, 101)],
+    }
+
+def centerbias_is_current(directory_path: str, sigma: float) -> bool:
+    """
+    Whether the saved centerbias of a directory was estimated with the given kernel size from
+    the fixation maps currently in the directory.
+    """
+    manifest_path = Path(directory_path) / f"centerbias_{sigma:g}.json"
+    if not (Path(directory_path) / f"centerbias_{sigma:g}.npy").exists() or not manifest_path.exists():
+        return False
+    with open(manifest_path) as file:
+        return load(file) == centerbias_manifest(directory_path, sigma)
+
 def centerbiases_for_transformations(sigma: float = 57.0) -> None:
     """
     Estimate the centerbias for each transformation in the dataset by averaging
     all fixation maps and applying a gaussian blur of kernel size `sigma`. Each
-    centerbias is saved as a numpy array file and an image file.
+    centerbias is saved as a numpy array file and an image file, named after the
+    kernel size as the predictors and `load_centerbias` expect (`centerbias_57.npy`).
+    A manifest of the inputs is saved alongside, and centerbiases which are still
+    current with their fixation maps are not estimated again.
     """
     for directory in directories:
-        if (Path(directory) / f"centerbias_{sigma}.npy").exists():
+        if centerbias_is_current(directory, sigma):
             continue
         centerbias = estimate_centerbias(directory, sigma)
-        save(f"{directory}/centerbias_{sigma}.npy", centerbias)
-        Image.fromarray((centerbias * 255).astype(uint8)).save(f"{directory}/centerbias_{sigma}.png")
\ No newline at end of file
+        save(f"{directory}/centerbias_{sigma:g}.npy", centerbias)
+        Image.fromarray((centerbias * 255).astype(uint8)).save(f"{directory}/centerbias_{sigma:g}.png")
+        manifest_path = Path(directory) / f"centerbias_{sigma:g}.json"
+        with atomic_write(manifest_path) as file:
+            dump(centerbias_manifest(directory, sigma), file)
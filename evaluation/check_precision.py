@@ -0,0 +1,14 @@
+from benchmark import check_float32_results
+from dataset import directories
+from pathlib import Path
+
+# Check that evaluating in float32 reproduces the published results in ../results, which needs the
+# dataset (with the predictions of both models) in ../data
+logging = True
+workers = 4
+missing = [directory for directory in directories if not Path(directory).exists()]
+if missing:
+    print(f"Skipping the float32 check, since {', '.join(missing)} is missing")
+else:
+    check_float32_results(logging=logging, workers=workers)
+    print("Evaluating in float32 reproduces the published results")
@@ -1,7 +1,11 @@
-from csv import writer, DictReader
+from csv import reader, writer, DictReader
+from json import dumps
+from numpy import arange, argsort, array, asarray, bincount, bool_, cumsum, empty, float32, float64, int64, isin, load, ndarray, ones, savez, split, unique, zeros
+from numpy.lib.format import open_memmap
 from pathlib import Path
 from PIL import Image
-from typing import List
+from prediction_pipeline import atomic_write
+from typing import Any, Iterable, Iterator, List
 from zipfile import ZipFile, ZIP_DEFLATED
 
 transformation_directories = [
@@ -30,6 +34,10 @@ directories = [
     *transformation_directories,
 ]
 
+# Derived data (indices and precomputed results) is kept outside of `../data`, since the
+# predictors treat every entry of that directory as a transformation directory.
+cache_directory = "../cache"
+
 def directories_omitting(omitting: list[str]) -> list[str]:
     filtered_directories = directories.copy()
     for omitting_directory in omitting:
@@ -60,22 +68,85 @@ def to_png(paths: list[Path], delete_original: bool = False) -> None:
         if delete_original:
             path.unlink()
         
+def consolidate_predictions(directory: str, model: str, image_numbers: range = range(1, 101), delete_original: bool = False) -> None:
+    """
+    Pack the per-image prediction files of a model in a directory (`{directory}/{model}/{n}.npy`)
+    into a single memory-mappable float32 array at `{directory}/{model}.npy`, of shape (images,
+    height, width), in which row `i` holds image number `i + 1`, with a boolean index at
+    `{directory}/{model}.index.npy` marking the rows written. This is the layout that the
+    predictors now write directly.
+    """
+    first_map = load(f"{directory}/{model}/{image_numbers[0]}.npy")
+    outputs = open_memmap(f"{directory}/{model}.npy", mode='w+', dtype=float32, shape=(max(image_numbers), *first_map.shape))
+    index = open_memmap(f"{directory}/{model}.index.npy", mode='w+', dtype=bool_, shape=(max(image_numbers),))
+    for image_number in image_numbers:
+        outputs[image_number - 1] = load(f"{directory}/{model}/{image_number}.npy")
+    outputs.flush()
+    index[[image_number - 1 for image_number in image_numbers]] = True
+    index.flush()
+    if delete_original:
+        for image_number in image_numbers:
+            Path(f"{directory}/{model}/{image_number}.npy").unlink()
+
+def consolidate_all_predictions(models: list[str], delete_original: bool = False) -> None:
+    """
+    Consolidate the per-image predictions of the given models in every directory of the dataset.
+    """
+    for directory in directories:
+        for model in models:
+            consolidate_predictions(directory, model, delete_original=delete_original)
+
 class Table:
     """
-    A table of data, useful for visualizing using matplotlib or saving to a CSV file.
+    A table of data, useful for visualizing using matplotlib or saving to a CSV file. Each
+    column is held as a typed NumPy array (float, int or str), so that columns can be read,
+    filtered and grouped without converting values one at a time. Rows may still be added one
+    at a time; they are buffered, and appended to the columns when the columns are next read.
     """
-    def __init__(self, headers: list[str]):
+    def __init__(self, headers: list[str], columns: dict[str, ndarray] | None = None):
+        """
+        Create a table with the given headers, empty unless the arrays of its columns are given.
         """
-        Create a table with the given headers.
+        self.columns = { header: asarray(columns[header]) if columns is not None else empty(0) for header in headers }
+        self.pending_rows = []
+
+    @property
+    def data(self) -> dict[str, ndarray]:
+        """
+        The columns of the table, by header.
+        """
+        if self.pending_rows:
+            for index, header in enumerate(self.columns.keys()):
+                self.columns[header] = column_array([*self.columns[header], *(row[index] for row in self.pending_rows)])
+            self.pending_rows = []
+        return self.columns
+
+    @property
+    def headers(self) -> list[str]:
+        """
+        The headers of the table, in order.
         """
-        self.data = { header: [] for header in headers }
+        return list(self.columns.keys())
+
+    def __len__(self) -> int:
+        """
+        The number of rows in the table.
+        """
+        return len(next(iter(self.data.values()), ()))
 
     def add_row(self, row: dict[str, float]) -> None:
         """
         Add a row to the table.
         """
-        for header in self.data.keys():
-            self.data[header].append(row[header])
+        self.pending_rows.append([row[header] for header in self.columns.keys()])
+
+    def rows(self) -> Iterator[dict]:
+        """
+        Iterate over the rows of the table, as dictionaries from header to value.
+        """
+        data = self.data
+        for index in range(len(self)):
+            yield { header: column[index] for header, column in data.items() }
 
     def to_csv(self, output_path: str = "benchmark.csv") -> None:
         """
@@ -83,22 +154,214 @@ class Table:
         """
         with open(output_path, 'w', newline='') as csvfile:
             output = writer(csvfile)
-            output.writerow(self.data.keys())
-            for i in range(len(self.data[next(iter(self.data.keys()))])):
-                output.writerow([self.data[header][i] for header in self.data.keys()])
+            output.writerow(self.headers)
+            output.writerows(zip(*self.data.values()))
 
     def load_csv(self, input_path: str) -> None:
         """
-        Load a table from a CSV file.
+        Load a table from a CSV file, converting each column to an array of ints or floats if
+        all of its values are numbers, and of strings otherwise.
         """
         with open(input_path, 'r', newline='') as csvfile:
-            reader = DictReader(csvfile)
-            self.data = { header: [] for header in reader.fieldnames }
-            for row in reader:
-                self.add_row(row)
+            rows = reader(csvfile)
+            headers = next(rows)
+            values = list(zip(*rows)) or [()] * len(headers)
+        self.columns = { header: parse_column(column) for header, column in zip(headers, values) }
+        self.pending_rows = []
+
+    def save(self, output_path: str) -> None:
+        """
+        Save the table in binary form, as an uncompressed .npz archive of its column arrays,
+        which `load_table` reads back without parsing.
+        """
+        with atomic_write(output_path, 'wb') as file:
+            savez(file, **self.data)
 
-    def get_column(self, column: str) -> list[float]:
+    def get_column(self, column: str) -> ndarray:
         """
         Get a column from the table.
         """
-        return self.data[column]
\ No newline at end of file
+        return self.data[column]
+
+    def select(self, mask: ndarray) -> 'Table':
+        """
+        Get a new table of the rows selected by a boolean mask (or an array of row indices).
+        """
+        return Table(self.headers, { header: column[mask] for header, column in self.data.items() })
+
+    def filter(self, **values: Any) -> 'Table':
+        """
+        Get a new table of the rows whose columns equal the given values, such as
+        `table.filter(model='unisal_384_224')`. A list of values selects rows equal to any of them.
+        """
+        mask = ones(len(self), dtype=bool_)
+        for header, value in values.items():
+            mask &= isin(self.get_column(header), value if isinstance(value, (list, tuple)) else [value])
+        return self.select(mask)
+
+    def group_numbers(self, *headers: str) -> tuple[list, ndarray]:
+        """
+        Number the distinct values of the given columns (or distinct tuples of values, if several
+        columns are given) in order of first appearance. Returns the list of distinct values and
+        an array of the number of the group of each row.
+        """
+        codes = zeros(len(self), dtype=int64)
+        for header in headers:
+            _, inverse = unique(self.get_column(header), return_inverse=True)
+            codes = codes * (inverse.max(initial=0) + 1) + inverse
+        _, first_rows, group_numbers = unique(codes, return_index=True, return_inverse=True)
+        order = argsort(first_rows)
+        renumbering = empty(len(order), dtype=int64)
+        renumbering[order] = arange(len(order))
+        keys = []
+        for first_row in first_rows[order]:
+            key = tuple(self.get_column(header)[first_row].item() for header in headers)
+            keys.append(key if len(headers) > 1 else key[0])
+        return keys, renumbering[group_numbers]
+
+    def group_by(self, *headers: str) -> dict[Any, 'Table']:
+        """
+        Split the table into a table per distinct value of the given columns (or per distinct
+        tuple of values, if several columns are given), such as
+        `table.group_by('transformation', 'model')`. Groups are ordered by first appearance, and
+        keep the order of their rows.
+        """
+        keys, group_numbers = self.group_numbers(*headers)
+        # Sorting the rows by group, stably, lays out every group contiguously and in order
+        group_rows = split(argsort(group_numbers, kind='stable'), cumsum(bincount(group_numbers, minlength=len(keys)))[:-1])
+        return { key: self.select(rows) for key, rows in zip(keys, group_rows) }
+
+def column_array(values: list) -> ndarray:
+    """
+    Convert the values of a column to a typed array, keeping numbers as numbers and storing
+    anything else as strings.
+    """
+    column = asarray(values)
+    return column.astype(str) if column.dtype == object else column
+
+def parse_column(values: Iterable[str]) -> ndarray:
+    """
+    Convert a column of values read as text to an array of ints, if all of them are integers,
+    of floats, if all of them are numbers, and of strings otherwise.
+    """
+    column = array(values, dtype=str)
+    for dtype in (int64, float64):
+        try:
+            return column.astype(dtype)
+        except ValueError:
+            pass
+    return column
+
+def load_table(input_path: str) -> Table:
+    """
+    Load a table saved by `Table.save`, or exported by `Table.to_csv`. For a CSV file, the
+    binary copy beside it (with the suffix .npz) is read instead if it is at least as new, so
+    that a CSV is only parsed if it has changed since the table was saved.
+    """
+    input_path = Path(input_path)
+    binary_path = input_path.with_suffix('.npz')
+    if binary_path.exists() and (input_path == binary_path or not input_path.exists() or binary_path.stat().st_mtime >= input_path.stat().st_mtime):
+        with load(binary_path) as archive:
+            return Table(archive.files, { header: archive[header] for header in archive.files })
+    table = Table([])
+    table.load_csv(input_path)
+    return table
+
+def parse_value(value: str) -> int | float | str:
+    """
+    Convert a value read from a CSV file back to the int or float it was written from, leaving
+    anything else as a string.
+    """
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+class RowLog:
+    """
+    A CSV file which the rows of a benchmark are appended to as they are computed, rather than
+    written once the whole table is complete, so that progress is on disk throughout a long run
+    and an interrupted run can be resumed. Each row is identified by the values of its key
+    columns (such as transformation, model and image number), and rows whose key is already in
+    the log are done. Only the keys are held in memory, never the rows themselves.
+
+    The rows of a log are only valid for the inputs and parameters they were computed from, so
+    a log may be given a tag describing them (any value which can be written as JSON), which is
+    kept beside it in `{path}.tag.json`. A log whose tag differs is started again.
+    """
+    def __init__(self, path: str, headers: list[str], key_columns: Iterable[str], tag: Any = None):
+        """
+        Open the log at the given path, keeping the rows already in it if it was written with
+        the same headers and tag, and otherwise starting it empty. A final row which was cut
+        short by an interruption is discarded.
+        """
+        self.path = Path(path)
+        self.tag_path = self.path.with_name(f"{self.path.name}.tag.json")
+        self.headers = list(headers)
+        self.key_columns = list(key_columns)
+        self.keys = set()
+        tag = dumps(tag)
+        if self.path.exists():
+            with open(self.path, 'rb') as file:
+                contents = file.read()
+            if not contents.endswith(b'\n'):
+                with open(self.path, 'r+b') as file:
+                    file.truncate(contents.rfind(b'\n') + 1)
+            with open(self.path, 'r', newline='') as csvfile:
+                same_headers = DictReader(csvfile).fieldnames == self.headers
+            same_tag = self.tag_path.exists() and self.tag_path.read_text() == tag
+            if same_headers and same_tag:
+                self.keys = { self.key(row) for row in self.rows() }
+        if not self.keys:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'w', newline='') as csvfile:
+                writer(csvfile).writerow(self.headers)
+            # The tag is only replaced once the rows computed under the old one are gone
+            with atomic_write(self.tag_path) as file:
+                file.write(tag)
+        self.file = open(self.path, 'a', newline='')
+        self.output = writer(self.file)
+
+    def key(self, row: dict) -> tuple:
+        """
+        Get the key of a row, with every value in the form in which it is read back from the log.
+        """
+        return tuple(parse_value(str(row[column])) for column in self.key_columns)
+
+    def __contains__(self, row_or_key: dict | tuple) -> bool:
+        """
+        Whether a row (or the key of a row) has already been written to the log.
+        """
+        key = self.key(row_or_key) if isinstance(row_or_key, dict) else tuple(parse_value(str(value)) for value in row_or_key)
+        return key in self.keys
+
+    def append(self, row: dict) -> None:
+        """
+        Write a row to the end of the log and flush it to disk.
+        """
+        self.output.writerow([row[header] for header in self.headers])
+        self.file.flush()
+        self.keys.add(self.key(row))
+
+    def rows(self) -> Iterator[dict]:
+        """
+        Read the rows written to the log back one at a time, with numbers converted back from
+        text.
+        """
+        with open(self.path, 'r', newline='') as csvfile:
+            for row in DictReader(csvfile):
+                yield { header: parse_value(value) for header, value in row.items() }
+
+    def close(self) -> None:
+        """
+        Close the log.
+        """
+        self.file.close()
+
+    def __enter__(self) -> 'RowLog':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
@@ -1,13 +1,32 @@
 from benchmark import all_fixation_point_averages, correlation_metrics
-from visualization import all_performance_degradation, all_pairwise_correlations, visualize_correlations
+from dataset import cache_directory
+from pathlib import Path
+from visualization import all_performance_degradation, all_pairwise_correlations, all_loss_pairwise_correlations, performance_averages_csv, render_figures
 
 logging = True
 all_correlations = False
-all_fixation_point_averages(logging=logging).to_csv("../results/all_fixation_point_averages.csv")
-correlation_metrics("deepgaze_1024_576", logging=logging).to_csv("../results/deepgaze_correlation_metrics.csv")
-correlation_metrics("unisal_384_224", logging=logging).to_csv("../results/unisal_correlation_metrics.csv")
-all_performance_degradation()
-if all_correlations:
-    visualize_correlations("../results/deepgaze_correlation_metrics.csv")
-    visualize_correlations("../results/unisal_correlation_metrics.csv")
-all_pairwise_correlations()
\ No newline at end of file
+# Render figures to ../results/figures without a display, rather than showing them one window at a time
+headless = True
+render_workers = 4
+# Scores are checkpointed per image as they are computed, so an interrupted run resumes where it stopped. A checkpoint
+# is started again if the predictions or parameters it was computed from have changed since
+averages = all_fixation_point_averages(logging=logging, checkpoint_path=f"{cache_directory}/fixation_point_scores.csv")
+# Tables are exported as CSV, and saved beside it in binary form for the visualizations to load without parsing
+# The averages are written where the performance degradation figures read them from
+averages.to_csv(performance_averages_csv)
+averages.save(Path(performance_averages_csv).with_suffix('.npz'))
+for model, name in [("deepgaze_1024_576", "deepgaze"), ("unisal_384_224", "unisal")]:
+    tables = correlation_metrics(model, logging=logging, checkpoint_path=f"{cache_directory}/{name}_correlation_metric_rows.csv")
+    tables['performance'].to_csv(f"../results/{name}_correlation_metrics.csv")
+    tables['performance'].save(f"../results/{name}_correlation_metrics.npz")
+    tables['loss'].to_csv(f"../results/{name}_loss_correlation_metrics.csv")
+    tables['loss'].save(f"../results/{name}_loss_correlation_metrics.npz")
+if headless:
+    rendered = render_figures(workers=render_workers)
+    if logging:
+        print(f"Rendered {len(rendered)} figures, skipping those whose results are unchanged")
+else:
+    all_performance_degradation()
+    if all_correlations:
+        all_loss_pairwise_correlations()
+    all_pairwise_correlations()
@@ -1,4 +1,4 @@
-from numpy import ndarray, log2, corrcoef
+from numpy import arange, asarray, broadcast_to, concatenate, float64, floor, int64, minimum, ndarray, log2, sqrt, where, zeros
 from scipy.special import kl_div
 from skimage.metrics import structural_similarity
 
@@ -12,9 +12,20 @@ def regularize(saliency_map: ndarray) -> ndarray:
     infinity for small probability values.
     """
     regularized = saliency_map - min(0.0, saliency_map.min()) + 1e-9
-    return regularized / regularized.sum()
+    # Accumulate in float64, but divide by a Python float so that float32 maps stay float32
+    return regularized / float(regularized.sum(dtype=float64))
 
-def NSS(saliency_map: ndarray, fixation_points: list[tuple[int, int]]) -> float:
+def sample_fixations(saliency_map: ndarray, fixation_points: ndarray | list[tuple[int, int]]) -> ndarray:
+    """
+    Sample a saliency map at fixation points, given either as an (N, 2)
+    array or as a list of (row, column) tuples. Integer points are read
+    directly, while fractional points (such as fixations rescaled to the
+    grid of a lower resolution map) are sampled bilinearly.
+    """
+    points = asarray(fixation_points).reshape(1, -1, 2)
+    return gather_fixations(saliency_map[None], points)[0]
+
+def NSS(saliency_map: ndarray, fixation_points: ndarray | list[tuple[int, int]]) -> float:
     """
     Normalized Scanpath Saliency (NSS) is a metric for evaluating
     the correspondence of a saliency map with a discrete set of
@@ -23,11 +34,72 @@ def NSS(saliency_map: ndarray, fixation_points: list[tuple[int, int]]) -> float:
     regularized. Positive values indicate correspondence, negative
     values indicate anti-correspondence.
     """
-    normalized_map = (saliency_map - saliency_map.mean()) / saliency_map.std()
-    total_score = 0.0
-    for x, y in fixation_points:
-        total_score += normalized_map[x, y]
-    return total_score / len(fixation_points)
+    mean = saliency_map.mean(dtype=float64)
+    std = saliency_map.std(dtype=float64)
+    return ((sample_fixations(saliency_map, fixation_points) - mean) / std).mean(dtype=float64)
+
+def pad_fixations(fixation_sets: list[ndarray]) -> tuple[ndarray, ndarray]:
+    """
+    Pad a ragged list of fixation point arrays (one (N, 2) array per
+    image) into a single (images, max_N, 2) index array. Also returns
+    an (images, max_N) boolean mask which marks the entries that are
+    real fixations rather than padding. Padding points index the
+    top-left pixel, so they are always valid to gather from. Fractional
+    points are kept as floats, to be sampled bilinearly.
+    """
+    counts = asarray([len(points) for points in fixation_sets])
+    mask = arange(max(counts.max(initial=0), 1)) < counts[:, None]
+    points = concatenate([asarray(points).reshape(-1, 2) for points in fixation_sets])
+    padded = zeros((*mask.shape, 2), dtype=int64 if points.dtype.kind in 'iu' else points.dtype)
+    padded[mask] = points
+    return padded, mask
+
+def gather_fixations(saliency_maps: ndarray, fixations: ndarray) -> ndarray:
+    """
+    Gather the values of a stack of saliency maps, shaped (..., images,
+    height, width), at padded fixation points shaped (images, max_N, 2).
+    The result is shaped (..., images, max_N). Fractional points are
+    sampled bilinearly from their four neighbouring pixels.
+    """
+    images = arange(saliency_maps.shape[-3])[:, None]
+    if fixations.dtype.kind in 'iu':
+        return saliency_maps[..., images, fixations[..., 0], fixations[..., 1]]
+    height, width = saliency_maps.shape[-2:]
+    top = floor(fixations[..., 0]).astype(int64).clip(0, height - 1)
+    left = floor(fixations[..., 1]).astype(int64).clip(0, width - 1)
+    bottom = minimum(top + 1, height - 1)
+    right = minimum(left + 1, width - 1)
+    row_weight = (fixations[..., 0] - top).clip(0.0, 1.0)
+    column_weight = (fixations[..., 1] - left).clip(0.0, 1.0)
+    return (
+        saliency_maps[..., images, top, left] * (1 - row_weight) * (1 - column_weight)
+        + saliency_maps[..., images, top, right] * (1 - row_weight) * column_weight
+        + saliency_maps[..., images, bottom, left] * row_weight * (1 - column_weight)
+        + saliency_maps[..., images, bottom, right] * row_weight * column_weight
+    )
+
+def batched_NSS(saliency_maps: ndarray, fixations: ndarray, mask: ndarray) -> ndarray:
+    """
+    Compute NSS for a stack of saliency maps, shaped (..., images, height,
+    width), against padded fixations as returned by `pad_fixations`. All
+    scores are computed in one gather, and returned shaped (..., images).
+    """
+    means = saliency_maps.mean(axis=(-2, -1), dtype=float64)[..., None]
+    stds = saliency_maps.std(axis=(-2, -1), dtype=float64)[..., None]
+    normalized = (gather_fixations(saliency_maps, fixations) - means) / stds
+    return where(mask, normalized, 0.0).sum(axis=-1) / mask.sum(axis=-1)
+
+def batched_IG(saliency_maps: ndarray, baselines: ndarray, fixations: ndarray, mask: ndarray) -> ndarray:
+    """
+    Compute IG for a stack of saliency maps, shaped (..., images, height,
+    width), against padded fixations as returned by `pad_fixations`. The
+    baselines must broadcast to (images, height, width), so that a single
+    centerbias may be shared by every image. Scores are returned shaped
+    (..., images).
+    """
+    baselines = broadcast_to(baselines, saliency_maps.shape[-3:])
+    gains = log2(gather_fixations(saliency_maps, fixations)) - log2(gather_fixations(baselines, fixations))
+    return where(mask, gains, 0.0).sum(axis=-1) / mask.sum(axis=-1)
 
 def CC(saliency_1: ndarray, saliency_2: ndarray) -> float:
     """
@@ -40,9 +112,13 @@ def CC(saliency_1: ndarray, saliency_2: ndarray) -> float:
     high frequency information is controlled using a low-pass (Gaussian) 
     filter.
     """
-    return corrcoef(saliency_1.flatten(), saliency_2.flatten())[0, 1]
+    # Computed without corrcoef, which would copy both maps to float64; only the sums are float64
+    centered_1 = saliency_1 - float(saliency_1.mean(dtype=float64))
+    centered_2 = saliency_2 - float(saliency_2.mean(dtype=float64))
+    covariance = (centered_1 * centered_2).sum(dtype=float64)
+    return covariance / sqrt((centered_1 * centered_1).sum(dtype=float64) * (centered_2 * centered_2).sum(dtype=float64))
 
-def IG(saliency_map: ndarray, baseline: ndarray, fixation_points: list[tuple[int, int]]) -> float:
+def IG(saliency_map: ndarray, baseline: ndarray, fixation_points: ndarray | list[tuple[int, int]]) -> float:
     """
     Information Gain (IG) is a metric for evaluating the performance
     of a saliency map over a baseline saliency map in predicting a set
@@ -51,10 +127,7 @@ def IG(saliency_map: ndarray, baseline: ndarray, fixation_points: list[tuple[int
     Positive values indicate that the saliency map is a better predictor
     than the baseline, while negative values indicate the opposite.
     """
-    total_gain = 0.0
-    for x, y in fixation_points:
-        total_gain += log2(saliency_map[x, y]) - log2(baseline[x, y])
-    return total_gain / len(fixation_points)
+    return (log2(sample_fixations(saliency_map, fixation_points)) - log2(sample_fixations(baseline, fixation_points))).mean(dtype=float64)
 
 def KL(ground_truth: ndarray, prediction: ndarray) -> float:
     """
@@ -70,7 +143,7 @@ def KL(ground_truth: ndarray, prediction: ndarray) -> float:
     Note that the KL divergence is not a symmetric metric, so the order
     of the saliency maps matters.
     """
-    return kl_div(ground_truth, prediction).sum()
+    return kl_div(ground_truth, prediction).sum(dtype=float64)
 
 def SSIM(reference: ndarray, transformed: ndarray) -> float:
     """
@@ -0,0 +1,221 @@
+from dataset import cache_directory, directories
+from io import BytesIO
+from math import cos, radians, sin
+from numpy import array, asarray, clip, concatenate, float32, floor, int16, load, ndarray, ones, save, stack, uint8
+from numpy.linalg import inv
+from numpy.random import default_rng
+from pathlib import Path
+from PIL import Image, ImageEnhance
+from scipy.ndimage import uniform_filter1d
+from skimage.color import rgb2gray
+from skimage.filters import sobel
+from utilities import load_centerbias, load_fixations, load_image, loader_cache
+
+class Transformation:
+    """
+    A parameterized image transformation which is applied to the reference images in memory,
+    instead of being read from a pre-rendered directory of the dataset. Transformations which
+    move image content also move fixation points and maps to match; all others leave them as
+    they are. The name of a transformation follows the dataset directories, with its parameter
+    appended (e.g. `Rotation_15`).
+    """
+    def __init__(self, parameter: float | None = None):
+        """
+        Create the transformation with the given intensity parameter, if it has one.
+        """
+        self.parameter = parameter
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the transformation, including its parameter.
+        """
+        if self.parameter is None:
+            return type(self).__name__
+        return f"{type(self).__name__}_{self.parameter:g}"
+
+    def apply_image(self, image: ndarray) -> ndarray:
+        """
+        Transform an image, given as a (height, width, 3) uint8 array, to an array of the same
+        shape and type.
+        """
+        raise NotImplementedError
+
+    def apply_map(self, saliency_map: ndarray) -> ndarray:
+        """
+        Move the content of a (height, width) map, such as a centerbias, as the transformation
+        moves the content of an image.
+        """
+        return saliency_map
+
+    def remap_fixations(self, fixation_points: ndarray, shape: tuple[int, int]) -> ndarray:
+        """
+        Move (N, 2) fixation points, in (row, column) order on an image of the given (height,
+        width) shape, as the transformation moves the content of the image. Points moved
+        outside of the image are dropped.
+        """
+        return fixation_points
+
+class AffineTransformation(Transformation):
+    """
+    A transformation which moves image content by an affine map of the image plane onto itself,
+    leaving areas of the output which no input maps to black.
+    """
+    def matrix(self, shape: tuple[int, int]) -> ndarray:
+        """
+        The 3x3 matrix of the affine map from input to output coordinates, for an image of the
+        given (height, width) shape. Coordinates are in (x, y) order, in continuous pixel units
+        where pixel (row, column) covers [column, column + 1] x [row, row + 1].
+        """
+        raise NotImplementedError
+
+    def warp(self, image: Image.Image) -> Image.Image:
+        """
+        Apply the affine map to a PIL image, keeping its size.
+        """
+        inverse = inv(self.matrix((image.height, image.width)))
+        return image.transform(image.size, Image.Transform.AFFINE, data=tuple(inverse[:2].flatten()), resample=Image.Resampling.BILINEAR)
+
+    def apply_image(self, image: ndarray) -> ndarray:
+        return array(self.warp(Image.fromarray(image)))
+
+    def apply_map(self, saliency_map: ndarray) -> ndarray:
+        return array(self.warp(Image.fromarray(saliency_map.astype(float32), mode='F')))
+
+    def remap_fixations(self, fixation_points: ndarray, shape: tuple[int, int]) -> ndarray:
+        points = asarray(fixation_points, dtype=float)
+        centers = concatenate([points[:, ::-1] + 0.5, ones((len(points), 1))], axis=1)
+        moved = floor((centers @ self.matrix(shape).T)[:, 1::-1]).astype(int)
+        inside = (moved >= 0).all(axis=1) & (moved < asarray(shape)).all(axis=1)
+        return moved[inside].astype(int16)
+
+class Compression(Transformation):
+    """
+    JPEG compression at the given quality, from 1 (strongest) to 95.
+    """
+    def apply_image(self, image: ndarray) -> ndarray:
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer, 'JPEG', quality=int(self.parameter))
+        buffer.seek(0)
+        return array(Image.open(buffer).convert('RGB'))
+
+class ContrastChange(Transformation):
+    """
+    Scaling of contrast about the mean intensity by the given factor, where 1 leaves the image
+    unchanged.
+    """
+    def apply_image(self, image: ndarray) -> ndarray:
+        return array(ImageEnhance.Contrast(Image.fromarray(image)).enhance(self.parameter))
+
+class Cropping(AffineTransformation):
+    """
+    Cropping to the centered fraction of the image given, enlarged back to the full image size.
+    """
+    def matrix(self, shape: tuple[int, int]) -> ndarray:
+        center_x, center_y = shape[1] / 2, shape[0] / 2
+        scale = 1 / self.parameter
+        return array([[scale, 0, center_x * (1 - scale)], [0, scale, center_y * (1 - scale)], [0, 0, 1]])
+
+class Inversion(Transformation):
+    """
+    Inversion of the colors of the image.
+    """
+    def apply_image(self, image: ndarray) -> ndarray:
+        return 255 - image
+
+class Mirroring(AffineTransformation):
+    """
+    Mirroring of the image about its vertical axis.
+    """
+    def matrix(self, shape: tuple[int, int]) -> ndarray:
+        return array([[-1, 0, shape[1]], [0, 1, 0], [0, 0, 1]])
+
+class MotionBlur(Transformation):
+    """
+    Horizontal motion blur over the given length in pixels.
+    """
+    def apply_image(self, image: ndarray) -> ndarray:
+        return uniform_filter1d(image, size=int(self.parameter), axis=1, mode='nearest')
+
+class Noise(Transformation):
+    """
+    Additive Gaussian noise with the given standard deviation, in intensity levels of 0 to 255.
+    The noise is seeded, so that it is the same on every run (and for every image).
+    """
+    def __init__(self, parameter: float, seed: int = 0):
+        """
+        Create the transformation with the given standard deviation and seed.
+        """
+        super().__init__(parameter)
+        self.seed = seed
+
+    def apply_image(self, image: ndarray) -> ndarray:
+        noise = default_rng(self.seed).normal(0, self.parameter, image.shape)
+        return clip(image + noise, 0, 255).astype(uint8)
+
+class Rotation(AffineTransformation):
+    """
+    Counterclockwise rotation of the image about its center by the given angle in degrees,
+    keeping the image size.
+    """
+    def matrix(self, shape: tuple[int, int]) -> ndarray:
+        center_x, center_y = shape[1] / 2, shape[0] / 2
+        # Image rows run downwards, so a counterclockwise rotation on screen is clockwise in (x, y)
+        cosine, sine = cos(radians(-self.parameter)), sin(radians(-self.parameter))
+        return array([
+            [cosine, -sine, center_x - cosine * center_x + sine * center_y],
+            [sine, cosine, center_y - sine * center_x - cosine * center_y],
+            [0, 0, 1],
+        ])
+
+class Shearing(AffineTransformation):
+    """
+    Horizontal shearing of the image about its center by the given factor, the horizontal
+    offset per pixel of height.
+    """
+    def matrix(self, shape: tuple[int, int]) -> ndarray:
+        return array([[1, self.parameter, -self.parameter * shape[0] / 2], [0, 1, 0], [0, 0, 1]])
+
+class Boundary(Transformation):
+    """
+    Replacement of the image with the magnitude of its edges, as white boundaries on black.
+    """
+    def apply_image(self, image: ndarray) -> ndarray:
+        edges = sobel(rgb2gray(image))
+        edges = (edges / max(edges.max(), 1e-12) * 255).astype(uint8)
+        return stack([edges] * 3, axis=-1)
+
+def transformed_image(transformation: Transformation, image_number: int) -> ndarray:
+    """
+    Apply a transformation to a reference image of the dataset.
+    """
+    return transformation.apply_image(loader_cache.load(load_image, directories[0], image_number))
+
+def transformed_fixations(transformation: Transformation, image_number: int) -> ndarray:
+    """
+    Move the fixation points of a reference image of the dataset as the transformation moves
+    its content.
+    """
+    return transformation.remap_fixations(load_fixations(directories[0], image_number), (1080, 1920))
+
+def transformed_centerbias(transformation: Transformation, kernel_size: int = 57) -> ndarray:
+    """
+    Move the centerbias of the reference images as the transformation moves their content,
+    as a baseline for scoring transformed images.
+    """
+    return transformation.apply_map(loader_cache.load(load_centerbias, directories[0], kernel_size))
+
+variants_directory = f"{cache_directory}/variants"
+
+def write_variants(transformations: list[Transformation], image_numbers: range = range(1, 101), centerbias_size: int = 57, directory: str = variants_directory) -> None:
+    """
+    Render transformations of the reference images to `{directory}/{transformation name}` for the
+    predictors, laid out like a directory of the dataset, with the raw centerbias of the dataset
+    moved as each transformation moves image content.
+    """
+    for transformation in transformations:
+        (Path(directory) / transformation.name / "images").mkdir(parents=True, exist_ok=True)
+        save(Path(directory) / transformation.name / f"centerbias_{centerbias_size}.npy", transformation.apply_map(load(f"{directories[0]}/centerbias_{centerbias_size}.npy")))
+    for image_number in image_numbers:
+        for transformation in transformations:
+            Image.fromarray(transformed_image(transformation, image_number)).save(Path(directory) / transformation.name / "images" / f"{image_number}.png")
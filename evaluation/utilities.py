@@ -1,22 +1,99 @@
+from collections import OrderedDict
+from dataset import cache_directory, directories
+from hashlib import blake2b, file_digest
+from json import dump, load as load_json
 from metrics import regularize
-from numpy import array, exp, load, ndarray, float32, ndindex
+from numpy import argwhere, array, asarray, concatenate, cumsum, exp, full, int16, int64, load, ndarray, float32, save, savez, zeros
+from pathlib import Path
 from PIL import Image
+from prediction_pipeline import atomic_write
 from scipy.ndimage import zoom
+from typing import Any, Callable, Iterable
 
-def load_centerbias(directory: str, kernel_size: int = 57) -> ndarray:
+precision: type | None = None
+
+def set_precision(dtype: type | None) -> None:
+    """
+    Set the floating point type which every loaded map is converted to, such as float32 to
+    halve the memory bandwidth of evaluating 1920x1080 maps, or None to keep each map in the
+    type it is stored in. Metrics accumulate their sums in float64 either way. Cached loads
+    are dropped, since they may hold maps of the previous type.
+    """
+    global precision
+    precision = dtype
+    loader_cache.clear()
+
+def get_precision() -> type | None:
     """
-    Load a centerbias from the dataset.
+    Get the floating point type set by `set_precision`.
     """
-    return regularize(load(f"{directory}/centerbias_{kernel_size}.npy"))
+    return precision
 
-def load_saliency_map(directory: str, model: str, image_number: int, resolution: (int, int)) -> ndarray:
+def to_precision(saliency_map: ndarray) -> ndarray:
+    """
+    Convert a map to the floating point type set by `set_precision`, if any.
+    """
+    return saliency_map if precision is None else saliency_map.astype(precision, copy=False)
+
+def load_centerbias(directory: str, kernel_size: int = 57, shape: tuple[int, int] | None = None) -> ndarray:
+    """
+    Load a centerbias from the dataset. If a (height, width) shape is given, the centerbias is
+    downsampled to it, to serve as the baseline of a saliency map evaluated at that resolution.
+    """
+    centerbias = to_precision(load(f"{directory}/centerbias_{kernel_size}.npy"))
+    if shape is not None and centerbias.shape != tuple(shape):
+        centerbias = zoom(centerbias, (shape[0] / centerbias.shape[0], shape[1] / centerbias.shape[1]), order=1)
+    return regularize(centerbias)
+
+prediction_arrays: dict[tuple[str, str], ndarray] = {}
+prediction_indices: dict[tuple[str, str], ndarray | None] = {}
+
+def load_predictions(directory: str, model: str) -> ndarray | None:
+    """
+    Memory-map the consolidated predictions of a model for a directory of the dataset, an
+    (images, height, width) float32 array of log densities in which row `i` holds image
+    number `i + 1`. Returns None if the predictions have not been consolidated. The mapping is
+    opened once per process, so that only the pages of the maps actually read are loaded, and
+    so that worker processes share them through the page cache.
+    """
+    key = (directory, model)
+    if key not in prediction_arrays:
+        path = Path(f"{directory}/{model}.npy")
+        if not path.exists():
+            return None
+        prediction_arrays[key] = load(path, mmap_mode='r')
+    return prediction_arrays[key]
+
+def load_prediction_index(directory: str, model: str) -> ndarray | None:
+    """
+    Load the index of the consolidated predictions of a model for a directory of the dataset, a
+    boolean array in which element `i` is set once the prediction for image number `i + 1` has
+    been written. Returns None if the predictions have no index, in which case every row is
+    taken to have been written. The index is read once per process, like the predictions.
+    """
+    key = (directory, model)
+    if key not in prediction_indices:
+        path = Path(f"{directory}/{model}.index.npy")
+        prediction_indices[key] = load(path) if path.exists() else None
+    return prediction_indices[key]
+
+def load_saliency_map(directory: str, model: str, image_number: int, resolution: tuple[int, int] | None) -> ndarray:
     """
     Load a saliency map from the dataset. Resize the image to the given resolution, specified in the
-    order of (width, height).
+    order of (width, height), or keep the native resolution of the model if the resolution is None.
+    Consolidated predictions are read if they exist and their index marks the image as written, and
+    otherwise the map is read from its own file.
     """
+    predictions = load_predictions(directory, model)
+    index = load_prediction_index(directory, model)
+    if predictions is None or (index is not None and not index[image_number - 1]):
+        saliency_map = exp(to_precision(load(f'{directory}/{model}/{image_number}.npy')))
+    else:
+        saliency_map = exp(to_precision(predictions[image_number - 1]))
+    if resolution is None:
+        return regularize(saliency_map)
     numpy_resolution = (resolution[1], resolution[0])
-    saliency_map = exp(load(f'{directory}/{model}/{image_number}.npy'))
-    if saliency_map.shape != resolution:
+    if saliency_map.shape != numpy_resolution:
         shape_scaling = (numpy_resolution[0] / saliency_map.shape[0], numpy_resolution[1] / saliency_map.shape[1])
         saliency_map = zoom(saliency_map, shape_scaling)
     return regularize(saliency_map)
@@ -25,7 +102,7 @@ def load_real_saliency_map(directory: str, image_number: int) -> ndarray:
     """
     Load a saliency image from the dataset.
     """
-    return regularize(array(Image.open(f'{directory}/real/{image_number}.png')))
+    return regularize(to_precision(array(Image.open(f'{directory}/real/{image_number}.png'))))
 
 def load_fixation_map(directory: str, image_number: int) -> ndarray:
     """
@@ -37,18 +114,140 @@ def load_fixation_map(directory: str, image_number: int) -> ndarray:
     image = image.astype(float32) / 255.0
     return image
 
-def fixation_map_to_points(fixation_map: ndarray) -> list[tuple[int, int]]:
+def fixation_map_to_points(fixation_map: ndarray) -> ndarray:
     """
     Convert a fixation map (a black image with white pixels marking
-    fixation locations) to a list of points.
+    fixation locations) to an (N, 2) integer array of points, each
+    point given in (row, column) order.
+    """
+    return argwhere(fixation_map > 0).astype(int16)
+
+class FixationIndex:
+    """
+    A compact on-disk index of the fixation points of every image in the dataset, so that
+    fixation maps are only decoded from PNG once. All points are stored in a single (N, 2)
+    int16 array which is memory-mapped on open, with per-image offsets into that array. The
+    modification time of each source PNG is recorded, and entries whose source has changed
+    since are decoded again when the index is built.
+    """
+    def __init__(self, path: str = f"{cache_directory}/fixation_index", directories: list[str] = directories, image_numbers: range = range(1, 101)):
+        """
+        Open the index stored at the given path, building or updating it first if it is
+        missing or out of date with the fixation maps of the given directories.
+        """
+        self.path = Path(path)
+        self.directories = list(directories)
+        self.image_numbers = list(image_numbers)
+        self.rows = {
+            (directory, image_number): row * len(self.image_numbers) + column
+            for row, directory in enumerate(self.directories)
+            for column, image_number in enumerate(self.image_numbers)
+        }
+        if not self.is_current():
+            self.build()
+        self.offsets = load(self.path / "offsets.npy")
+        self.mtimes = load(self.path / "mtimes.npy")
+        self.points_array = load(self.path / "points.npy", mmap_mode='r')
+
+    def source_mtimes(self) -> ndarray:
+        """
+        Get the modification time (in nanoseconds) of each source fixation map, or -1 for
+        those that do not exist.
+        """
+        mtimes = full((len(self.directories), len(self.image_numbers)), -1, dtype=int64)
+        for (directory, image_number), row in self.rows.items():
+            path = Path(f"{directory}/fixations/{image_number}.png")
+            if path.exists():
+                mtimes.flat[row] = path.stat().st_mtime_ns
+        return mtimes
+
+    def is_current(self) -> bool:
+        """
+        Check whether the index on disk covers the same images as this one, and whether
+        none of the source fixation maps have been modified since it was built.
+        """
+        try:
+            with open(self.path / "manifest.json", 'r') as file:
+                manifest = load_json(file)
+            mtimes = load(self.path / "mtimes.npy")
+        except FileNotFoundError:
+            return False
+        return (
+            manifest == { 'directories': self.directories, 'image_numbers': self.image_numbers }
+            and (mtimes == self.source_mtimes()).all()
+        )
+
+    def build(self) -> None:
+        """
+        Build the index, reusing the points of any entry in a previously built index for
+        the same images whose source fixation map has not been modified since.
+        """
+        previous = None
+        if (self.path / "manifest.json").exists():
+            with open(self.path / "manifest.json", 'r') as file:
+                if load_json(file) == { 'directories': self.directories, 'image_numbers': self.image_numbers }:
+                    previous = (load(self.path / "offsets.npy"), load(self.path / "mtimes.npy"), load(self.path / "points.npy"))
+        mtimes = self.source_mtimes()
+        points = []
+        for (directory, image_number), row in self.rows.items():
+            if mtimes.flat[row] < 0:
+                points.append(zeros((0, 2), dtype=int16))
+            elif previous is not None and previous[1].flat[row] == mtimes.flat[row]:
+                points.append(previous[2][previous[0][row]:previous[0][row + 1]])
+            else:
+                points.append(fixation_map_to_points(load_fixation_map(directory, image_number)))
+        offsets = concatenate([[0], cumsum([len(image_points) for image_points in points])]).astype(int64)
+        self.path.mkdir(parents=True, exist_ok=True)
+        save(self.path / "points.npy", concatenate(points).astype(int16))
+        save(self.path / "offsets.npy", offsets)
+        save(self.path / "mtimes.npy", mtimes)
+        # The manifest is written last, so that an interrupted build is never taken as current
+        with open(self.path / "manifest.json", 'w') as file:
+            dump({ 'directories': self.directories, 'image_numbers': self.image_numbers }, file)
+
+    def points(self, directory: str, image_number: int) -> ndarray | None:
+        """
+        Get the fixation points of an image as an (N, 2) int16 array, or None if the image
+        is not covered by the index.
+        """
+        row = self.rows.get((directory, image_number))
+        if row is None or self.mtimes.flat[row] < 0:
+            return None
+        return self.points_array[self.offsets[row]:self.offsets[row + 1]]
+
+fixation_index: FixationIndex | None = None
+
+def build_fixation_index() -> FixationIndex:
+    """
+    Open the fixation index for the whole dataset, building it first if it is missing or
+    out of date. Later calls to `load_fixations` read from this index.
     """
-    return [(x, y) for x, y in ndindex(fixation_map.shape) if fixation_map[x, y] > 0]
+    global fixation_index
+    fixation_index = FixationIndex()
+    return fixation_index
 
-def load_fixations(directory: str, image_number: int) -> list[tuple[int, int]]:
+def load_fixations(directory: str, image_number: int) -> ndarray:
     """
-    Load a set of fixation points from the dataset.
+    Load a set of fixation points from the dataset. Points are read from the fixation
+    index, which is built on first use, and only decoded from the fixation map for
+    images which the index does not cover.
     """
-    return fixation_map_to_points(load_fixation_map(directory, image_number))
+    points = (fixation_index or build_fixation_index()).points(directory, image_number)
+    if points is None:
+        return fixation_map_to_points(load_fixation_map(directory, image_number))
+    return points
+
+def rescale_fixations(fixation_points: ndarray, shape: tuple[int, int], source_shape: tuple[int, int] = (1080, 1920)) -> ndarray:
+    """
+    Rescale fixation points from the (height, width) grid of the dataset images to the grid of
+    a saliency map of the given shape. Points are returned unchanged if both grids match, and are
+    otherwise returned as fractional coordinates (mapping pixel centers onto pixel centers) to be
+    sampled bilinearly.
+    """
+    if tuple(shape) == tuple(source_shape):
+        return fixation_points
+    scale = asarray(shape) / asarray(source_shape)
+    return ((asarray(fixation_points) + 0.5) * scale - 0.5).clip(0, asarray(shape) - 1)
 
 def load_image(directory: str, image_number: int) -> ndarray:
     """
@@ -56,12 +255,209 @@ def load_image(directory: str, image_number: int) -> ndarray:
     """
     return array(Image.open(f'{directory}/images/{image_number}.png'))
 
+class LoaderCache:
+    """
+    A least-recently-used cache for the results of the loading functions in this module,
+    bounded by a budget on the total number of bytes held. Cached arrays are shared between
+    all callers, so they are made read-only.
+    """
+    def __init__(self, max_bytes: int = 1024 ** 3):
+        """
+        Create an empty cache which holds at most `max_bytes` bytes of loaded data.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, loader: Callable[..., Any], *args: Any) -> Any:
+        """
+        Call `loader` with the given arguments, or return the cached result of an earlier
+        call with the same loader and arguments.
+        """
+        key = (loader.__name__, args)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = loader(*args)
+        if isinstance(value, ndarray):
+            value.flags.writeable = False
+        size = getattr(value, 'nbytes', 0)
+        if size <= self.max_bytes:
+            self.entries[key] = value
+            self.size += size
+            self.evict()
+        return value
+
+    def evict(self) -> None:
+        """
+        Drop the least recently used entries until the cache is within its budget.
+        """
+        while self.size > self.max_bytes:
+            _, value = self.entries.popitem(last=False)
+            self.size -= getattr(value, 'nbytes', 0)
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        Change the byte budget of the cache, evicting entries if it has shrunk.
+        """
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self) -> None:
+        """
+        Drop all entries and reset the hit and miss counters.
+        """
+        self.entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {len(self.entries)} entries using {self.size / 1024 ** 2:.1f} of {self.max_bytes / 1024 ** 2:.1f} MiB"
+
+loader_cache = LoaderCache()
+
 def get_transformation_name(directory: str) -> str:
     """
     Get the name of a transformation from the directory path string.
     """
     return directory.split('/')[-1]
 
+def file_hash(path: str) -> str:
+    """
+    Get a hash of the contents of a file.
+    """
+    with open(path, 'rb') as file:
+        return file_digest(file, 'blake2b').hexdigest()
+
+def files_stamp(paths: Iterable[Path]) -> str:
+    """
+    Get a hash of the size and modification time of each of the given files (or of its absence),
+    which changes whenever any of them is written, without reading their contents (as the
+    fixation index detects changed fixation maps).
+    """
+    stamp = blake2b()
+    for path in paths:
+        stamp.update(str(path).encode())
+        if path.exists():
+            status = path.stat()
+            stamp.update(f"{status.st_size} {status.st_mtime_ns}".encode())
+    return stamp.hexdigest()
+
+def benchmark_input_paths(directory: str, models: list[str], centerbias_size: int, image_numbers: range = range(1, 101), include_images: bool = False) -> list[Path]:
+    """
+    List the files of a directory of the dataset which benchmarks of the given models read: the
+    centerbias of the given kernel size, the fixation maps, the saliency maps of every model
+    (both consolidated and per image, or the real saliency maps for 'real'), and the images if
+    `include_images` is set.
+    """
+    paths = [Path(f"{directory}/centerbias_{centerbias_size}.npy")]
+    paths += [Path(f"{directory}/fixations/{image_number}.png") for image_number in image_numbers]
+    for model in models:
+        if model == 'real':
+            paths += [Path(f"{directory}/real/{image_number}.png") for image_number in image_numbers]
+        elif model != 'centerbias':
+            paths += [Path(f"{directory}/{model}{suffix}") for suffix in ('.npy', '.index.npy', '.manifest.json')]
+            paths += [Path(f"{directory}/{model}/{image_number}.npy") for image_number in image_numbers]
+    if include_images:
+        paths += [Path(f"{directory}/images/{image_number}.png") for image_number in image_numbers]
+    return paths
+
+class SSIMStore:
+    """
+    A persistent table of the SSIM between each reference image and its transformed
+    counterparts. SSIM does not depend on the model being benchmarked, so each image pair
+    only needs to be computed once. Every entry records a content hash of both image files,
+    so that pairs whose images have changed since are reported as stale. The size and
+    modification time of each image are kept with its hash, and an image is only hashed again
+    once either has changed, so that checking an up-to-date store does not read the dataset.
+    """
+    def __init__(self, path: str = f"{cache_directory}/ssim.npz"):
+        """
+        Open the store at the given path, which need not exist yet.
+        """
+        self.path = Path(path)
+        self.entries = {}
+        self.image_hashes = {}
+        self.image_hashes_changed = False
+        if self.path.exists():
+            with load(self.path) as data:
+                for transformation, image_number, reference_hash, transformed_hash, ssim in zip(
+                    data['transformations'], data['image_numbers'], data['reference_hashes'], data['transformed_hashes'], data['ssim']
+                ):
+                    self.entries[(str(transformation), int(image_number))] = (str(reference_hash), str(transformed_hash), float(ssim))
+                # Stores written before image hashes were kept have them computed again
+                if 'image_paths' in data:
+                    for image_path, size, mtime, image_hash in zip(data['image_paths'], data['image_sizes'], data['image_mtimes'], data['image_hashes']):
+                        self.image_hashes[str(image_path)] = (int(size), int(mtime), str(image_hash))
+
+    def image_hash(self, image_path: str) -> str:
+        """
+        Get the content hash of an image, hashing it only if its size or modification time has
+        changed since it was last hashed.
+        """
+        status = Path(image_path).stat()
+        cached = self.image_hashes.get(image_path)
+        if cached is None or cached[:2] != (status.st_size, status.st_mtime_ns):
+            cached = (status.st_size, status.st_mtime_ns, file_hash(image_path))
+            self.image_hashes[image_path] = cached
+            self.image_hashes_changed = True
+        return cached[2]
+
+    def stale_pairs(self, reference_directory: str, transformation_directories: list[str], image_numbers: range = range(1, 101)) -> list[tuple[str, int, str, str]]:
+        """
+        List the (transformation directory, image number, reference hash, transformed hash)
+        of every image pair which has no entry, or whose images no longer match the hashes of
+        its entry. Pairs are ordered by image first.
+        """
+        stale = []
+        for image_number in image_numbers:
+            reference_hash = self.image_hash(f"{reference_directory}/images/{image_number}.png")
+            for transformation_directory in transformation_directories:
+                transformed_hash = self.image_hash(f"{transformation_directory}/images/{image_number}.png")
+                entry = self.entries.get((get_transformation_name(transformation_directory), image_number))
+                if entry is None or entry[:2] != (reference_hash, transformed_hash):
+                    stale.append((transformation_directory, image_number, reference_hash, transformed_hash))
+        return stale
+
+    def record(self, transformation_directory: str, image_number: int, reference_hash: str, transformed_hash: str, ssim: float) -> None:
+        """
+        Record the SSIM of an image pair, along with the hashes of both images.
+        """
+        self.entries[(get_transformation_name(transformation_directory), image_number)] = (reference_hash, transformed_hash, float(ssim))
+
+    def ssim(self, transformation_directory: str, image_number: int) -> float:
+        """
+        Look up the SSIM between a transformed image and its reference image.
+        """
+        return self.entries[(get_transformation_name(transformation_directory), image_number)][2]
+
+    def save(self) -> None:
+        """
+        Write the store to disk.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        keys = list(self.entries.keys())
+        image_paths = list(self.image_hashes.keys())
+        with atomic_write(self.path, 'wb') as file:
+            savez(
+                file,
+                transformations=array([transformation for transformation, _ in keys]),
+                image_numbers=array([image_number for _, image_number in keys]),
+                reference_hashes=array([self.entries[key][0] for key in keys]),
+                transformed_hashes=array([self.entries[key][1] for key in keys]),
+                ssim=array([self.entries[key][2] for key in keys]),
+                image_paths=array(image_paths),
+                image_sizes=array([self.image_hashes[image_path][0] for image_path in image_paths], dtype=int64),
+                image_mtimes=array([self.image_hashes[image_path][1] for image_path in image_paths], dtype=int64),
+                image_hashes=array([self.image_hashes[image_path][2] for image_path in image_paths]),
+            )
+        self.image_hashes_changed = False
+
 def normalize_to_range(image: ndarray, min_value: float = 0.0, max_value: float = 1.0) -> ndarray:
     """
     Normalize the image to the range [min_value, max_value].
@@ -1,15 +1,42 @@
-from csv import reader, DictReader
-from dataset import directories_omitting
+from analysis import pairwise_statistics
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataset import directories_omitting, load_table, Table
+from functools import partial
+from json import dump as dump_json, load as load_json
+import matplotlib
 from matplotlib import pyplot
-from numpy import linspace, polyfit, corrcoef, uint8, zeros
+from numpy import linspace, uint8, zeros
+from pathlib import Path
 from PIL import Image
+from prediction_pipeline import atomic_write
 from random import seed, randint
 from scipy.ndimage import gaussian_filter
-from scipy.stats import zscore
-from utilities import load_image, get_transformation_name
+from typing import Callable
+from utilities import file_hash, load_image, get_transformation_name
 
 unisal_color = '#ff4040'
 deepgaze_color = '#0000a0'
+model_colors = { 'UNISAL': unisal_color, 'DeepGaze IIE': deepgaze_color }
+
+# The averages per transformation and model which `benchmark.all_fixation_point_averages` computes
+performance_averages_csv = "../results/all_performance_averages.csv"
+
+# The size figures are saved at, that of a maximized window on a 1920x1080 display
+saved_figure_size = (19.2, 10.8)
+
+def show_or_save(output_path: str | None = None) -> None:
+    """
+    Show the current figure in a window or, if an output path is given, save it there and
+    close it, which needs no display.
+    """
+    if output_path is None:
+        pyplot.show()
+        return
+    figure = pyplot.gcf()
+    figure.set_size_inches(saved_figure_size)
+    figure.savefig(output_path, dpi=100)
+    pyplot.close(figure)
 
 def fixation_map_example() -> None:
     seed(0)
@@ -30,7 +57,7 @@ def real_map_example() -> None:
     real_map = real_map / real_map.max()
     Image.fromarray((real_map * 255).astype(uint8)).save("../docs/real_map_example.png")
 
-def transformation_examples() -> None:
+def transformation_examples(output_path: str | None = None) -> None:
     rows = 6
     columns = 3
     _, axes = pyplot.subplots(rows, columns)
@@ -49,18 +76,15 @@ def transformation_examples() -> None:
         axes[row, column].imshow(window)
         axes[row, column].set_title(transformation)
     pyplot.subplots_adjust(wspace=0, hspace=0.3)
-    pyplot.show()
+    show_or_save(output_path)
 
-def performance_degradation(csv_file: str, unisal_model: str, deepgaze_model: str, metric: str) -> None:
+def performance_degradation(csv_file: str, unisal_model: str, deepgaze_model: str, metric: str, output_path: str | None = None) -> None:
     _, axes = pyplot.subplots(2, 5)
-    data = { 'centerbias': {}, 'real': {}, unisal_model: {}, deepgaze_model: {} }
-    with open(csv_file, 'r') as file:
-        for row in DictReader(file):
-            transformation = row['transformation']
-            model_name = row['model']
-            value = float(row[metric])
-            if model_name in data:
-                data[model_name][transformation] = value
+    table = load_table(csv_file)
+    data = {}
+    for model_name in ['centerbias', 'real', unisal_model, deepgaze_model]:
+        model_rows = table.filter(model=model_name)
+        data[model_name] = dict(zip(model_rows.get_column('transformation').tolist(), model_rows.get_column(metric).tolist()))
     plots = {
         'Boundary': ('Reference', 'Boundary'),
         'Compression': ('Reference', 'Compression_1', 'Compression_2'),
@@ -99,111 +123,167 @@ def performance_degradation(csv_file: str, unisal_model: str, deepgaze_model: st
     for axis in axes.flat:
         axis.set_ylim(min_value, max_value)
     pyplot.subplots_adjust(wspace=0.3, hspace=0.6)
-    pyplot.show()
+    show_or_save(output_path)
 
 def all_performance_degradation() -> None:
-    performance_degradation("../results/all_performance_averages.csv", "unisal_384_224", "deepgaze_1024_576", "mean_nss")
-    performance_degradation("../results/all_performance_averages.csv", "unisal_384_224", "deepgaze_1024_576", "mean_ig")
+    performance_degradation(performance_averages_csv, "unisal_384_224", "deepgaze_1024_576", "mean_nss")
+    performance_degradation(performance_averages_csv, "unisal_384_224", "deepgaze_1024_576", "mean_ig")
 
-def pairwise_correlations(
-    unisal_csv_file: str,
-    deepgaze_csv_file: str,
-    independent_variable: str,
-    dependent_variable: str,
-    z_score_threshold: float = 3.0,
-    title: str | None = None
-) -> None:
-    unisal_x = {}
-    unisal_y = {}
-    deepgaze_x = {}
-    deepgaze_y = {}
-    for x, y, csv_file in [(unisal_x, unisal_y, unisal_csv_file), (deepgaze_x, deepgaze_y, deepgaze_csv_file)]:
-        with open(csv_file, 'r') as file:
-            for row in DictReader(file):
-                transformation = row['transformation']
-                independent_value = float(row[independent_variable])
-                dependent_value = float(row[dependent_variable])
-                if transformation not in x:
-                    x[transformation] = []
-                    y[transformation] = []
-                x[transformation].append(independent_value)
-                y[transformation].append(dependent_value)
-    max_y = float('-inf')
-    max_x = float('-inf')
-    min_y = float('inf')
-    min_x = float('inf')
-    for transformation in unisal_x:
-        for data_x, data_y in [(unisal_x, unisal_y), (deepgaze_x, deepgaze_y)]:
-            x_zscores = zscore(data_x[transformation])
-            y_zscores = zscore(data_y[transformation])
-            filtered_x = []
-            filtered_y = []
-            for index in range(100):
-                if x_zscores[index] < z_score_threshold and y_zscores[index] < z_score_threshold:
-                    filtered_x.append(data_x[transformation][index])
-                    filtered_y.append(data_y[transformation][index])
-                    max_y = max(max_y, data_y[transformation][index])
-                    min_y = min(min_y, data_y[transformation][index])
-                    max_x = max(max_x, data_x[transformation][index])
-                    min_x = min(min_x, data_x[transformation][index])
-            data_x[transformation] = filtered_x
-            data_y[transformation] = filtered_y
+def plot_pairwise_correlations(statistics: dict[str, Table], title: str | None = None, output_path: str | None = None) -> None:
+    """
+    Plot the points and fitted lines of one pair of columns, as computed by
+    `analysis.pairwise_statistics`, in a grid with one plot per transformation. The figure is
+    shown, or saved to the output path if one is given.
+    """
+    points = statistics['points']
+    min_x, max_x = points.get_column('x').min(), points.get_column('x').max()
+    min_y, max_y = points.get_column('y').min(), points.get_column('y').max()
+    model_points = points.group_by('transformation', 'model')
     _, axes = pyplot.subplots(3, 6)
-    for transformation, axis in zip(unisal_x.keys(), axes.flat):
+    for (transformation, fits), axis in zip(statistics['fits'].group_by('transformation').items(), axes.flat):
         axis.set_title(transformation)
-        plot_settings = [
-            ('UNISAL', unisal_x, unisal_y, unisal_color),
-            ('DeepGaze IIE', deepgaze_x, deepgaze_y, deepgaze_color),
-        ]
         label = ""
-        for model, x, y, color in plot_settings:
-            correlation = corrcoef(x[transformation], y[transformation])[0, 1]
+        for model, correlation, slope, intercept in zip(*(fits.get_column(column) for column in ['model', 'correlation', 'slope', 'intercept'])):
+            color = model_colors[model]
             label += f"{model}: {correlation:.2f}\n"
-            slope, intercept = polyfit(x[transformation], y[transformation], 1)
-            line = { 'x': [min_x, max_x], 'y': [slope * min_x + intercept, slope * max_x + intercept] }
-            axis.scatter(x[transformation], y[transformation], color=color, alpha=0.1)
-            axis.plot(line['x'], line['y'], color=color)
+            if (transformation, model) in model_points:
+                axis.scatter(model_points[(transformation, model)].get_column('x'), model_points[(transformation, model)].get_column('y'), color=color, alpha=0.1)
+            axis.plot([min_x, max_x], [slope * min_x + intercept, slope * max_x + intercept], color=color)
         axis.set_xlabel(label)
         axis.set_xlim(min_x, max_x)
         axis.set_ylim(min_y, max_y)
     pyplot.subplots_adjust(wspace=0.3, hspace=0.7)
     if title:
         pyplot.title(title)
-    pyplot.show()
+    show_or_save(output_path)
+
+def pairwise_correlation_grids(unisal_csv_file: str, deepgaze_csv_file: str, pairs: list[tuple[str, str]], z_score_threshold: float = 3.0, titled: bool = False) -> None:
+    """
+    Plot a grid of pairwise correlations for each (independent, dependent) pair of columns,
+    loading the tables once and computing the statistics of every pair together. If `titled`
+    is set, each grid is titled with its pair.
+    """
+    tables = { 'UNISAL': load_table(unisal_csv_file), 'DeepGaze IIE': load_table(deepgaze_csv_file) }
+    statistics = pairwise_statistics(tables, pairs, z_score_threshold)
+    for independent_variable, dependent_variable in pairs:
+        title = f"{independent_variable} vs {dependent_variable}" if titled else None
+        plot_pairwise_correlations(statistics[(independent_variable, dependent_variable)], title)
+
+def pairwise_correlations(
+    unisal_csv_file: str,
+    deepgaze_csv_file: str,
+    independent_variable: str,
+    dependent_variable: str,
+    z_score_threshold: float = 3.0,
+    title: str | None = None
+) -> None:
+    tables = { 'UNISAL': load_table(unisal_csv_file), 'DeepGaze IIE': load_table(deepgaze_csv_file) }
+    statistics = pairwise_statistics(tables, [(independent_variable, dependent_variable)], z_score_threshold)
+    plot_pairwise_correlations(statistics[(independent_variable, dependent_variable)], title)
 
 def strong_pairwise_correlations() -> None:
-    pairs = [
-        ('reference_nss', 'transformed_nss'),
-        ('reference_ig', 'transformed_ig'),
-        ('cc', 'transformed_nss'),
-    ]
-    for independent, dependent in pairs:
-        pairwise_correlations(
-            "../results/unisal_correlation_metrics.csv",
-            "../results/deepgaze_correlation_metrics.csv",
-            independent,
-            dependent
-        )
+    pairwise_correlation_grids(
+        "../results/unisal_correlation_metrics.csv",
+        "../results/deepgaze_correlation_metrics.csv",
+        [('reference_nss', 'transformed_nss'), ('reference_ig', 'transformed_ig'), ('cc', 'transformed_nss')]
+    )
 
 def all_pairwise_correlations() -> None:
-    for independent_variable in ['ssim', 'cc', 'kl', 'reference_nss', 'reference_ig']:
-        for dependent_variable in ['transformed_nss', 'transformed_ig']:
-            pairwise_correlations(
-                "../results/unisal_correlation_metrics.csv",
-                "../results/deepgaze_correlation_metrics.csv",
-                independent_variable,
-                dependent_variable
-            )
+    pairwise_correlation_grids(
+        "../results/unisal_correlation_metrics.csv",
+        "../results/deepgaze_correlation_metrics.csv",
+        [(independent_variable, dependent_variable) for independent_variable in ['ssim', 'cc', 'kl', 'reference_nss', 'reference_ig'] for dependent_variable in ['transformed_nss', 'transformed_ig']]
+    )
 
 def all_loss_pairwise_correlations() -> None:
-    for independent_variable in ['ssim', 'cc', 'kl', 'reference_nss', 'reference_ig']:
-        for dependent_variable in ['loss_nss', 'loss_ig']:
-            pairwise_correlations(
-                "../results/unisal_loss_correlation_metrics.csv",
-                "../results/deepgaze_loss_correlation_metrics.csv",
-                independent_variable,
-                dependent_variable,
-                title=f"{independent_variable} vs {dependent_variable}"
-            )
-
-all_loss_pairwise_correlations()
+    pairwise_correlation_grids(
+        "../results/unisal_loss_correlation_metrics.csv",
+        "../results/deepgaze_loss_correlation_metrics.csv",
+        [(independent_variable, dependent_variable) for independent_variable in ['ssim', 'cc', 'kl', 'reference_nss', 'reference_ig'] for dependent_variable in ['loss_nss', 'loss_ig']],
+        titled=True
+    )
+
+def use_headless_backend() -> None:
+    """
+    Switch matplotlib to a non-interactive backend, which renders to files without a display.
+    """
+    matplotlib.use('Agg')
+
+def render_figure(job: tuple[str, Callable[..., None]]) -> str:
+    """
+    Render one figure of `render_figures` to its output path, returning the path.
+    """
+    output_path, plot = job
+    plot(output_path=output_path)
+    return output_path
+
+def render_figures(output_directory: str = "../results/figures", workers: int = 1, force: bool = False) -> list[str]:
+    """
+    Render the figures of the results (the performance degradation and every pairwise
+    correlation grid) to PNG files in the output directory, without a display, in a pool of
+    `workers` processes if more than one is requested.
+
+    A manifest in the output directory records, for every figure, the hashes of the CSV files
+    it was rendered from and of this module. Figures whose record is unchanged are not rendered
+    again unless `force` is set, and the statistics of the pairwise correlations are only
+    computed for the grids which are rendered. Returns the paths of the figures rendered.
+    """
+    use_headless_backend()
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_directory / "manifest.json"
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path) as file:
+            manifest = load_json(file)
+    hashes = {}
+
+    def stale_key(name: str, input_paths: list[str], parameters: list) -> list | None:
+        for path in [__file__, *input_paths]:
+            if path not in hashes:
+                hashes[path] = file_hash(path)
+        key = [*(hashes[path] for path in [__file__, *input_paths]), parameters]
+        if force or manifest.get(name) != key or not (output_directory / f"{name}.png").exists():
+            return key
+        return None
+
+    jobs = []
+    for metric in ['mean_nss', 'mean_ig']:
+        name = f"performance_degradation_{metric}"
+        key = stale_key(name, [performance_averages_csv], [metric])
+        if key is not None:
+            jobs.append((name, key, partial(performance_degradation, performance_averages_csv, "unisal_384_224", "deepgaze_1024_576", metric)))
+    grids = [
+        ("pairwise", "../results/unisal_correlation_metrics.csv", "../results/deepgaze_correlation_metrics.csv", ['transformed_nss', 'transformed_ig'], False),
+        ("loss_pairwise", "../results/unisal_loss_correlation_metrics.csv", "../results/deepgaze_loss_correlation_metrics.csv", ['loss_nss', 'loss_ig'], True),
+    ]
+    for prefix, unisal_csv_file, deepgaze_csv_file, dependent_variables, titled in grids:
+        stale_pairs = {}
+        for independent_variable in ['ssim', 'cc', 'kl', 'reference_nss', 'reference_ig']:
+            for dependent_variable in dependent_variables:
+                name = f"{prefix}_{independent_variable}_vs_{dependent_variable}"
+                key = stale_key(name, [unisal_csv_file, deepgaze_csv_file], [independent_variable, dependent_variable, titled])
+                if key is not None:
+                    stale_pairs[(independent_variable, dependent_variable)] = (name, key)
+        if not stale_pairs:
+            continue
+        tables = { 'UNISAL': load_table(unisal_csv_file), 'DeepGaze IIE': load_table(deepgaze_csv_file) }
+        statistics = pairwise_statistics(tables, list(stale_pairs))
+        for (independent_variable, dependent_variable), (name, key) in stale_pairs.items():
+            title = f"{independent_variable} vs {dependent_variable}" if titled else None
+            jobs.append((name, key, partial(plot_pairwise_correlations, statistics[(independent_variable, dependent_variable)], title)))
+
+    render_jobs = [(str(output_directory / f"{name}.png"), plot) for name, _, plot in jobs]
+    output_paths = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_headless_backend) if workers > 1 else nullcontext() as executor:
+        rendered = executor.map(render_figure, render_jobs) if workers > 1 else map(render_figure, render_jobs)
+        # Record each figure as soon as it is rendered, so that an interrupted run keeps its progress
+        for (name, key, _), output_path in zip(jobs, rendered):
+            manifest[name] = key
+            with atomic_write(manifest_path) as file:
+                dump_json(manifest, file)
+            output_paths.append(output_path)
+    return output_paths
+
+if __name__ == "__main__":
+    all_loss_pairwise_correlations()
@@ -0,0 +1,232 @@
+# Prediction pipeline shared by the DeepGaze and UNISAL predictors (and the evaluation), which run in separate
+# environments
+
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from hashlib import blake2b
+from json import dump, load
+from os import replace
+from numpy import array, bool_, float32, ndarray
+from numpy.lib.format import open_memmap
+from pathlib import Path
+from PIL import Image
+from queue import Queue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import IO, Callable, Iterator, Optional, Union
+
+@contextmanager
+def atomic_write(path: Union[str, Path], mode: str = 'w') -> Iterator[IO]:
+    """
+    Open a file to write in place of the file at the given path, which is only replaced once the new file is complete,
+    so that an interrupted write never leaves a partial file behind.
+    """
+    path = Path(path)
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    with open(temporary_path, mode) as file:
+        yield file
+    replace(temporary_path, path)
+
+def precision_output_name(output_name: str, precision: str) -> str:
+    """
+    Name the outputs of a reduced precision mode apart from the float32 outputs (e.g. `unisal_384_224_int8`), so that
+    both can be kept and compared.
+    """
+    return output_name if precision == 'float32' else f"{output_name}_{precision}"
+
+class StageTimer:
+    """
+    Accumulated wall time and item counts for each stage of a prediction pipeline. Stages may be timed from several
+    threads at once, in which case their times are summed over threads.
+    """
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.lock = Lock()
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1) -> Iterator[None]:
+        """
+        Time the enclosed block as `items` items passing through the given stage.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self.lock:
+                self.seconds[stage] += elapsed
+                self.counts[stage] += items
+
+    def report(self) -> str:
+        """
+        Summarize the time spent in each stage.
+        """
+        return "\n".join(
+            f"{stage}: {seconds:.2f} s over {self.counts[stage]} items ({seconds / max(self.counts[stage], 1) * 1000:.1f} ms each)"
+            for stage, seconds in self.seconds.items()
+        )
+
+def load_resized(image_path: Path, resolutions: list, timer: StageTimer) -> dict:
+    """
+    Decode an image once and resize it to each of the given resolutions, in the order of (width, height). Returns a
+    dictionary from resolution to image data.
+    """
+    with timer.time('decode'):
+        image = Image.open(image_path)
+        image.load()
+    with timer.time('resize', len(resolutions)):
+        return { resolution: array(image.resize(resolution, Image.Resampling.LANCZOS)) for resolution in resolutions }
+
+def prefetch(load: Callable, items: list, workers: int = 4, depth: int = 8) -> Iterator[tuple]:
+    """
+    Yield `(item, load(item))` for each item in order, while a pool of `workers` threads loads the following items in
+    the background. At most `depth` items are loaded ahead of the consumer, which bounds memory use.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(items)
+        pending = deque()
+        for item in remaining:
+            pending.append((item, executor.submit(load, item)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            item, future = pending.popleft()
+            result = future.result()
+            for next_item in remaining:
+                pending.append((next_item, executor.submit(load, next_item)))
+                break
+            yield item, result
+
+class BackgroundWriter:
+    """
+    A thread which runs the writes handed to it, in order, so that the caller does not wait for outputs to be written.
+    Writes wait in a queue of bounded depth, so that a slow disk applies back pressure rather than exhausting memory.
+    """
+    def __init__(self, depth: int = 8, timer: Optional[StageTimer] = None):
+        self.queue = Queue(maxsize=depth)
+        self.timer = timer or StageTimer()
+        self.error = None
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            write = self.queue.get()
+            if write is None:
+                return
+            if self.error is None:
+                try:
+                    with self.timer.time('write'):
+                        write()
+                except Exception as error:
+                    self.error = error
+
+    def submit(self, write: Callable[[], None]) -> None:
+        """
+        Queue a write, blocking while the queue is full. Raises the error of any earlier write which failed.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(write)
+
+    def close(self) -> None:
+        """
+        Wait for all queued writes to finish, raising the error of any write which failed.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+def file_hash(path: Path) -> str:
+    """
+    Get a hash of the contents of a file.
+    """
+    digest = blake2b()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def weights_hash(module) -> str:
+    """
+    Get a hash of the parameters and buffers of a PyTorch module, in the order of its state dict. Quantized tensors are
+    hashed by their dequantized values, and entries which are not tensors (as in quantized modules) by their repr.
+    """
+    digest = blake2b()
+    for name, value in module.state_dict().items():
+        digest.update(name.encode())
+        if not hasattr(value, 'is_quantized'):
+            digest.update(repr(value).encode())
+            continue
+        if value.is_quantized:
+            value = value.dequantize()
+        digest.update(value.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+class PredictionContainer:
+    """
+    The predictions of one model for one directory of the dataset, held in a single memory-mappable float32 array of
+    shape (images, height, width) at `{directory}/{name}.npy`, in which row `i` holds the log density of image number
+    `i + 1`. Alongside it, a boolean index at `{directory}/{name}.index.npy` records which rows have been written, so
+    that readers can tell a complete prediction from an empty row of an interrupted run.
+
+    A manifest at `{directory}/{name}.manifest.json` records, for every row written, the key it was predicted from:
+    the hash of the image, the hash of the model weights, the resolution and the source (anything else the prediction
+    depends on). Rows whose key is unchanged are current, and need not be predicted again.
+    """
+    def __init__(self, directory: Path, name: str, image_count: int, numpy_resolution: tuple):
+        """
+        Open the container for `image_count` images at the given (height, width) resolution, keeping the rows already
+        written if the container exists with that shape, and otherwise creating it empty.
+        """
+        data_path = directory / f"{name}.npy"
+        index_path = directory / f"{name}.index.npy"
+        self.manifest_path = directory / f"{name}.manifest.json"
+        shape = (image_count, *numpy_resolution)
+        if data_path.exists() and index_path.exists() and self.manifest_path.exists():
+            self.data = open_memmap(data_path, mode='r+')
+            self.index = open_memmap(index_path, mode='r+')
+            with open(self.manifest_path) as file:
+                self.manifest = load(file)
+            if self.data.shape == shape and self.data.dtype == float32 and self.index.shape == (image_count,):
+                return
+        self.data = open_memmap(data_path, mode='w+', dtype=float32, shape=shape)
+        self.index = open_memmap(index_path, mode='w+', dtype=bool_, shape=(image_count,))
+        self.manifest = {}
+        self.save_manifest()
+
+    def is_current(self, image_number: int, key: list) -> bool:
+        """
+        Whether the prediction for the given image number has been written from the given key.
+        """
+        return bool(self.index[image_number - 1]) and self.manifest.get(str(image_number)) == key
+
+    def write(self, rows: list, predictions: ndarray, keys: Optional[list] = None) -> None:
+        """
+        Write a batch of predictions to the given rows, recording the key of each in the manifest if keys are given.
+        The rows are only marked as written in the index once their data has been flushed to disk.
+        """
+        self.data[rows] = predictions
+        self.data.flush()
+        self.index[rows] = True
+        self.index.flush()
+        if keys is not None:
+            for row, key in zip(rows, keys):
+                self.manifest[str(row + 1)] = key
+            self.save_manifest()
+
+    def save_manifest(self) -> None:
+        """
+        Write the manifest to disk with `atomic_write`.
+        """
+        with atomic_write(self.manifest_path) as file:
+            dump(self.manifest, file)
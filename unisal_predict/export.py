@@ -0,0 +1,158 @@
+from copy import deepcopy
+from time import perf_counter
+from typing import Callable, Iterable
+from torch import Tensor, backends, cat, jit, nn, no_grad, rand
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.nn.functional import interpolate, pad
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from patched_unisal import UNISAL, DomainBatchNorm2d
+from unisal.unisal import utils
+
+def select_source_batchnorms(module: nn.Module, source: str) -> None:
+    """
+    Replace every domain-specific BatchNorm in a module, in place, with the BatchNorm of the given source, so that no
+    BatchNorm is chosen by name at runtime.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, DomainBatchNorm2d):
+            setattr(module, name, getattr(child, f"bn_{source}"))
+        else:
+            select_source_batchnorms(child, source)
+
+def fold_batchnorms(module: nn.Module) -> None:
+    """
+    Fold every BatchNorm which directly follows a convolution in a sequential block into that convolution, in place,
+    using the running statistics of the BatchNorm. The module must be in eval mode.
+    """
+    for child in module.modules():
+        if isinstance(child, nn.Sequential):
+            for index in range(len(child) - 1):
+                if isinstance(child[index], nn.Conv2d) and isinstance(child[index + 1], nn.BatchNorm2d):
+                    child[index] = fuse_conv_bn_eval(child[index], child[index + 1])
+                    child[index + 1] = nn.Identity()
+
+class StaticUNISAL(nn.Module):
+    """
+    A UNISAL model specialized for inference on the static images of a single source. The BatchNorms of that source
+    are folded into the convolutions, and the RNN and the modules of all other sources are dropped, so that the layers
+    used are plain attributes rather than looked up by name on every call.
+    """
+    def __init__(self, unisal: UNISAL, source: str = "SALICON"):
+        """
+        Specialize a copy of a loaded UNISAL model, leaving the original untouched.
+        """
+        super().__init__()
+        unisal = deepcopy(unisal).eval()
+        select_source_batchnorms(unisal, source)
+        fold_batchnorms(unisal)
+        source_str = f"_{source.lower()}"
+        self.cnn = unisal.cnn
+        self.skip_2x = unisal.skip_2x
+        self.skip_4x = unisal.skip_4x
+        self.post_cnn = unisal.post_cnn
+        self.upsampling_1 = unisal.upsampling_1
+        self.upsampling_2 = unisal.upsampling_2
+        self.post_upsampling_2 = unisal.post_upsampling_2
+        self.adaptation = getattr(unisal, "adaptation" + (source_str if unisal.ds_adaptation else ""))
+        self.smoothing = getattr(unisal, "smoothing" + (source_str if unisal.ds_smoothing else ""))
+        self.smoothing_padding = unisal.smoothing_ksize // 2
+        self.gaussians = None
+        if unisal.n_gaussians > 0:
+            self.gaussians = getattr(unisal, "coarse_gaussians" + (source_str if unisal.ds_gaussians else ""))
+        self.eval()
+
+    def forward(self, x: Tensor) -> Tensor:
+        """
+        Predict the log density saliency maps of a batch of images of shape (batch, channel, height, width), returning
+        a tensor of shape (batch, 1, height, width).
+        """
+        feat_1x, feat_2x, feat_4x = self.cnn(x)
+        feat_2x = self.skip_2x(feat_2x)
+        feat_4x = self.skip_4x(feat_4x)
+        if self.gaussians is not None:
+            feat_1x = cat((feat_1x, UNISAL._make_gaussian_maps(feat_1x, self.gaussians)), dim=1)
+        feat = self.post_cnn(feat_1x)
+
+        feat = self.upsampling_1(feat)
+        feat = cat((feat, feat_2x), dim=1)
+        feat = self.upsampling_2(feat)
+        # If an odd-numbered factor in the shape causes a mismatch in dimensions, cut the last index (by slicing rather
+        # than branching, so that the module can be traced symbolically for quantization)
+        feat = feat[:, :, :feat_4x.shape[-2], :]
+        feat = cat((feat, feat_4x), dim=1)
+        feat = self.post_upsampling_2(feat)
+        feat = self.adaptation(feat)
+
+        feat = interpolate(feat, size=x.shape[-2:], mode="nearest")
+        feat = pad(feat, [self.smoothing_padding] * 4, mode="replicate")
+        feat = self.smoothing(feat)
+        return utils.log_softmax(feat)
+
+def export_unisal(unisal: UNISAL, source: str = "SALICON", example: Tensor | None = None) -> nn.Module:
+    """
+    Specialize a loaded UNISAL model for the static images of a single source. If an example batch is given, the
+    result is also traced with TorchScript; the traced module only serves inputs of the example's resolution.
+    """
+    exported = StaticUNISAL(unisal, source)
+    if example is None:
+        return exported
+    with no_grad():
+        return jit.freeze(jit.trace(exported, example))
+
+def quantize_unisal(exported: StaticUNISAL, calibration_batches: Iterable[Tensor], backend: str = 'x86') -> nn.Module:
+    """
+    Quantize an exported UNISAL model to int8 by post-training static quantization, with the ranges of its activations
+    calibrated on the given batches of images of shape (batch, channel, height, width). The calibration images should
+    be representative of the images predicted, but need not share their resolution. The result only runs on the CPU.
+    """
+    backends.quantized.engine = backend
+    calibration_batches = iter(calibration_batches)
+    first_batch = next(calibration_batches)
+    prepared = prepare_fx(deepcopy(exported).cpu().eval(), get_default_qconfig_mapping(backend), example_inputs=(first_batch,))
+    with no_grad():
+        prepared(first_batch)
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+def benchmark_latency(model: Callable[[Tensor], Tensor], example: Tensor, repeats: int = 10, warmup: int = 2) -> float:
+    """
+    Measure the mean time in seconds that a model takes to process an example batch, after some warm up calls.
+    """
+    with no_grad():
+        for _ in range(warmup):
+            model(example)
+        start = perf_counter()
+        for _ in range(repeats):
+            model(example)
+        return (perf_counter() - start) / repeats
+
+def compare_latency(unisal: UNISAL, resolution: (int, int) = (384, 224), batch_size: int = 1, source: str = "SALICON", repeats: int = 10) -> dict[str, float]:
+    """
+    Compare the CPU latency of a loaded UNISAL model before and after exporting it, for a random batch at the given
+    resolution, in the order of (width, height). Returns the seconds per batch of the original, exported and traced
+    models, and the largest absolute difference between the predictions of the original and the traced model.
+    """
+    unisal = deepcopy(unisal).cpu().eval()
+    example = rand(batch_size, 3, resolution[1], resolution[0])
+    exported = export_unisal(unisal, source)
+    traced = export_unisal(unisal, source, example)
+    with no_grad():
+        difference = (unisal(example.unsqueeze(1), source=source, static=True).squeeze(1) - traced(example)).abs().max().item()
+    return {
+        "original": benchmark_latency(lambda batch: unisal(batch.unsqueeze(1), source=source, static=True), example, repeats),
+        "exported": benchmark_latency(exported, example, repeats),
+        "traced": benchmark_latency(traced, example, repeats),
+        "difference": difference,
+    }
+
+if __name__ == "__main__":
+    from main import UNISALPredictor
+    predictor = UNISALPredictor(device='cpu')
+    for resolution in [(384, 224), (1920, 1080)]:
+        latency = compare_latency(predictor.unisal, resolution)
+        print(
+            f"{resolution[0]}x{resolution[1]}: {latency['original'] * 1000:.1f} ms original, {latency['exported'] * 1000:.1f} ms exported, "
+            f"{latency['traced'] * 1000:.1f} ms traced (largest difference {latency['difference']:.2e})"
+        )
@@ -1,52 +1,235 @@
-from numpy import array, save
+from functools import partial
+from numpy import array, ndarray, stack
 from pathlib import Path
 from PIL import Image
-from torch import no_grad, cuda, from_numpy
+from time import perf_counter
+from torch import autocast, bfloat16, no_grad, cuda, from_numpy
 from patched_unisal import UNISAL
+from export import export_unisal, quantize_unisal
+from prediction_pipeline import BackgroundWriter, StageTimer, PredictionContainer, file_hash, load_resized, precision_output_name, prefetch, weights_hash
 
-DEVICE = 'cuda'
-
-def predict(image_paths: list[Path], resolution: (int, int), output_name: str, finetuned: bool = False) -> None:
-    """
-    Predict the saliency map for a set of images using the UNISAL model. Rescales images to be the resolution
-    provided, in the order of (width, height).
-    """
-    unisal = UNISAL(sources=("DHF1K", "Hollywood", "UCFSports", "SALICON"))
-    if finetuned:
-        unisal.load_weights(Path("unisal/training_runs/pretrained_unisal"), "ft_mit1003")
-    else:
-        unisal.load_best_weights(Path("unisal/training_runs/pretrained_unisal"))
-    unisal.to(DEVICE)
-    unisal.eval()
-    cuda.empty_cache()
-    with no_grad():
-        for image_path in image_paths:
-            output_path = Path(str(image_path).replace('images', output_name).replace('png', 'npy'))
-            image = Image.open(image_path)
-            image = image.resize(resolution, Image.Resampling.LANCZOS)
-            image_data = array(image) / 255
-            batch = from_numpy(image_data).permute(2, 0, 1).unsqueeze(0).unsqueeze(0).float().to(DEVICE)
-            prediction = unisal(batch, source="SALICON") # The static image data UNISAL was trained on was from SALICON
-            prediction = prediction.squeeze(0).squeeze(0).squeeze(0).cpu().detach().numpy()
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            save(output_path, prediction)
-
-def predict_dataset(model_resolution: (int, int), output_name: str, finetuned: bool = False) -> None:
+DEVICE = 'cuda' if cuda.is_available() else 'cpu'
+PRECISIONS = ('float32', 'bfloat16', 'int8')
+
+class UNISALPredictor:
+    """
+    A UNISAL model which is constructed and has its weights loaded once, and then serves predictions for any image
+    at any resolution. The time taken to construct and load the model is kept in `startup_seconds`, and the time spent
+    in each stage of predicting is accumulated in `timer`. Predictions are made for the SALICON source, and are keyed by
+    a hash of the loaded weights so that outputs which are already current can be skipped.
+    """
+    def __init__(self, finetuned: bool = False, device: str = DEVICE, batch_size: int = 8, decode_workers: int = 4, queue_depth: int = 8, exported: bool = False, precision: str = 'float32', calibration_images: int = 16):
+        """
+        Construct the model and load either the best pretrained weights or, if `finetuned` is set, the weights
+        finetuned on MIT1003. If `exported` is set, the model is specialized for SALICON with its BatchNorms folded (see
+        `export.StaticUNISAL`), which is faster but not bitwise identical. Images are predicted `batch_size` at a time.
+        When sweeping, `decode_workers` threads decode and resize images ahead of inference, and at most `queue_depth`
+        images (or batches awaiting writing) are held in memory.
+
+        `precision` is one of `PRECISIONS`. 'bfloat16' runs the model under bfloat16 autocast, and 'int8' quantizes the
+        exported model on the CPU, calibrated on the first `calibration_images` images of `../data/Reference`. Outputs
+        of a reduced precision are named with the precision as a suffix, as in `precision_output_name`.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+        if precision == 'int8' and device != 'cpu':
+            raise ValueError("int8 inference is only supported on the CPU")
+        start = perf_counter()
+        self.device = device
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.queue_depth = queue_depth
+        self.timer = StageTimer()
+        self.unisal = UNISAL(sources=("DHF1K", "Hollywood", "UCFSports", "SALICON"))
+        if finetuned:
+            self.unisal.load_weights(Path("unisal/training_runs/pretrained_unisal"), "ft_mit1003")
+        else:
+            self.unisal.load_best_weights(Path("unisal/training_runs/pretrained_unisal"))
+        self.unisal.to(device)
+        self.unisal.eval()
+        self.source = "SALICON" # The static image data UNISAL was trained on was from SALICON
+        self.precision = precision
+        self.exported = exported or precision == 'int8'
+        if self.exported:
+            self.unisal = export_unisal(self.unisal, self.source)
+        if precision == 'int8':
+            self.unisal = quantize_unisal(self.unisal, self.calibration_batches(calibration_images))
+        self.weights_hash = weights_hash(self.unisal)
+        if device.startswith('cuda'):
+            cuda.empty_cache()
+        self.startup_seconds = perf_counter() - start
+
+    def calibration_batches(self, image_count: int, resolution: (int, int) = (384, 224)) -> list:
+        """
+        Load the first `image_count` reference images, rescaled to the given resolution, in the order of (width,
+        height), as batches of at most `batch_size` images for calibrating quantization.
+        """
+        image_paths = [Path("../data/Reference/images") / f"{image_number}.png" for image_number in range(1, image_count + 1)]
+        batches = []
+        for start in range(0, len(image_paths), self.batch_size):
+            image_data = stack([load_resized(image_path, [resolution], self.timer)[resolution] for image_path in image_paths[start:start + self.batch_size]])
+            batches.append(from_numpy(image_data / 255).permute(0, 3, 1, 2).float())
+        return batches
+
+    def predict_arrays(self, image_data: ndarray) -> ndarray:
+        """
+        Predict the log density saliency maps of a batch of already resized images, given as an array of shape
+        (images, height, width, 3) with values between 0 and 255. Returns an array of shape (images, height, width).
+        """
+        batch = from_numpy(image_data / 255).permute(0, 3, 1, 2).float().to(self.device)
+        with no_grad(), autocast(self.device.split(':')[0], dtype=bfloat16, enabled=self.precision == 'bfloat16'):
+            if self.exported:
+                prediction = self.unisal(batch)
+            else:
+                prediction = self.unisal(batch.unsqueeze(1), source=self.source, static=True).squeeze(1)
+        return prediction.squeeze(1).float().cpu().detach().numpy()
+
+    def predict_batch(self, images: list[Image.Image], resolution: (int, int)) -> ndarray:
+        """
+        Predict the log density saliency maps of a batch of images, each rescaled to be the resolution provided, in the
+        order of (width, height). Returns an array of shape (images, height, width).
+        """
+        return self.predict_arrays(stack([array(image.resize(resolution, Image.Resampling.LANCZOS)) for image in images]))
+
+    def predict_image(self, image: Image.Image, resolution: (int, int)) -> ndarray:
+        """
+        Predict the log density saliency map of a single image, rescaled to be the resolution provided, in the order
+        of (width, height).
+        """
+        return self.predict_batch([image], resolution)[0]
+
+    def sweep(self, image_paths: list[Path], outputs: dict[tuple[int, int], str]) -> int:
+        """
+        Predict the saliency map for a set of images at several resolutions in a single traversal, where `outputs` maps
+        each resolution, in the order of (width, height), to its output name. Each image is decoded once and resized to
+        every resolution, and images are predicted in batches per resolution.
+
+        Decoding and resizing run ahead of inference in a pool of threads, and predictions are written by a background
+        thread, so that the three stages overlap. The time spent in each stage is added to `timer`.
+
+        Predictions are written to a `PredictionContainer` next to the `images` directory per output name (suffixed
+        with a reduced precision), in which row `i` holds the log density of image number `i + 1`. Each row is keyed by
+        the hash of its image, the hash of the weights, the resolution, the source and the precision, and rows whose key
+        is unchanged are skipped, so that an interrupted sweep resumes where it stopped. Returns the number of images
+        predicted.
+        """
+        directory = image_paths[0].parent.parent
+        image_count = max(int(image_path.stem) for image_path in image_paths)
+        containers = {
+            resolution: PredictionContainer(directory, precision_output_name(output_name, self.precision), image_count, (resolution[1], resolution[0]))
+            for resolution, output_name in outputs.items()
+        }
+        with self.timer.time('hash', len(image_paths)):
+            image_hashes = { image_path: file_hash(image_path) for image_path in image_paths }
+        keys = {
+            resolution: { image_path: [image_hashes[image_path], self.weights_hash, list(resolution), self.source, self.precision] for image_path in image_paths }
+            for resolution in containers
+        }
+        stale = {
+            image_path: [resolution for resolution, container in containers.items() if not container.is_current(int(image_path.stem), keys[resolution][image_path])]
+            for image_path in image_paths
+        }
+        image_paths = [image_path for image_path in image_paths if stale[image_path]]
+
+        def load(image_path: Path) -> dict:
+            return load_resized(image_path, stale[image_path], self.timer)
+
+        def predict_and_write(batch: list[tuple[Path, dict]]) -> None:
+            for resolution, container in containers.items():
+                batch_paths = [image_path for image_path, resized in batch if resolution in resized]
+                if not batch_paths:
+                    continue
+                with self.timer.time('inference', len(batch_paths)):
+                    predictions = self.predict_arrays(stack([resized[resolution] for _, resized in batch if resolution in resized]))
+                rows = [int(image_path.stem) - 1 for image_path in batch_paths]
+                writer.submit(partial(container.write, rows, predictions, [keys[resolution][image_path] for image_path in batch_paths]))
+
+        with BackgroundWriter(self.queue_depth, self.timer) as writer:
+            batch = []
+            for image_path, resized in prefetch(load, image_paths, self.decode_workers, self.queue_depth):
+                batch.append((image_path, resized))
+                if len(batch) == self.batch_size:
+                    predict_and_write(batch)
+                    batch = []
+            if batch:
+                predict_and_write(batch)
+        return len(image_paths)
+
+    def predict(self, image_paths: list[Path], resolution: (int, int), output_name: str) -> int:
+        """
+        Predict the saliency map for a set of images using the UNISAL model. Rescales images to be the resolution
+        provided, in the order of (width, height).
+
+        Predictions are written to a `PredictionContainer` next to the `images` directory, named after `output_name`,
+        in which row `i` holds the log density of image number `i + 1`. Images whose prediction is already current are
+        skipped, and the number of images predicted is returned.
+        """
+        return self.sweep(image_paths, { resolution: output_name })
+
+def predict(image_paths: list[Path], resolution: (int, int), output_name: str, finetuned: bool = False, predictor: UNISALPredictor | None = None) -> None:
+    """
+    Predict the saliency map for a set of images using the UNISAL model, as in `UNISALPredictor.predict`. A new
+    predictor is constructed unless one is given.
+    """
+    (predictor or UNISALPredictor(finetuned)).predict(image_paths, resolution, output_name)
+
+def predict_dataset(model_resolution: (int, int), output_name: str, finetuned: bool = False, predictor: UNISALPredictor | None = None) -> None:
     """
     Predict the saliency map for all images in the dataset at `../data` using the UNISAL model. Rescales images to be the resolution
-    provided, in the order of (width, height).
+    provided, in the order of (width, height). The model is loaded once for the whole dataset, unless a predictor is given.
+    """
+    predictor = predictor or UNISALPredictor(finetuned)
+    for directory in Path("../data").iterdir():
+        image_paths = [ directory / "images" / f"{image_number}.png" for image_number in range(1, 101) ]
+        predictor.predict(image_paths, model_resolution, output_name)
+
+def sweep_dataset(outputs: dict[tuple[int, int], str], finetuned: bool = False, predictor: UNISALPredictor | None = None) -> int:
+    """
+    Predict the saliency map for all images in the dataset at `../data` using the UNISAL model at several resolutions in
+    a single traversal of the dataset, as in `UNISALPredictor.sweep`. Predictions which are already current are skipped,
+    and the number of images predicted is returned.
     """
+    predictor = predictor or UNISALPredictor(finetuned)
+    predicted = 0
     for directory in Path("../data").iterdir():
         image_paths = [ directory / "images" / f"{image_number}.png" for image_number in range(1, 101) ]
-        predict(image_paths, model_resolution, output_name, finetuned)
+        predicted += predictor.sweep(image_paths, outputs)
+    return predicted
+
+def predict_variants(outputs: dict[tuple[int, int], str], finetuned: bool = False, directory: Path = Path("../cache/variants"), predictor: UNISALPredictor | None = None) -> int:
+    """
+    Predict the saliency map for the transformations of the reference images rendered by `write_variants` of the
+    evaluation code, where each transformation is a directory under `directory` laid out like a directory of the
+    dataset. Images are predicted at several resolutions as in `sweep_dataset`, so that the evaluation code can read
+    the predictions of each output name back. Predictions which are already current are skipped, and the number of
+    images predicted is returned.
+    """
+    predictor = predictor or UNISALPredictor(finetuned)
+    predicted = 0
+    for variant_directory in sorted(directory.iterdir()):
+        image_paths = sorted((variant_directory / "images").glob("*.png"), key=lambda image_path: int(image_path.stem))
+        if image_paths:
+            predicted += predictor.sweep(image_paths, outputs)
+    return predicted
 
-def predict_predefined_resolutions() -> None:
+def predict_predefined_resolutions(finetuned: bool = False, logging: bool = True, precision: str = 'float32') -> None:
     """
     Predict the saliency map for all images in the dataset at `../data` using the UNISAL model for predefined resolutions.
+    The model is constructed and loaded once, and every image is decoded once for all resolutions. The outputs of a
+    reduced precision (see `UNISALPredictor`) are written alongside the float32 outputs, and int8 always runs on the CPU.
     """
-    predict_dataset((384, 224), "unisal_384_224")
-    predict_dataset((384, 288), "unisal_384_288")
-    predict_dataset((384, 216), "unisal_384_216")
-    predict_dataset((1920, 1080), "unisal_1920_1080")
+    predictor = UNISALPredictor(finetuned, device='cpu' if precision == 'int8' else DEVICE, precision=precision)
+    if logging:
+        print(f"Constructed UNISAL and loaded its weights in {predictor.startup_seconds:.2f} seconds")
+    predicted = sweep_dataset({
+        (384, 224): "unisal_384_224",
+        (384, 288): "unisal_384_288",
+        (384, 216): "unisal_384_216",
+        (1920, 1080): "unisal_1920_1080",
+    }, predictor=predictor)
+    if logging:
+        print(f"Predicted {predicted} images, skipping those already current")
+        print(predictor.timer.report())
 
-predict_predefined_resolutions()
\ No newline at end of file
+if __name__ == "__main__":
+    predict_predefined_resolutions()
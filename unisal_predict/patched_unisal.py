@@ -191,6 +191,7 @@ class UNISAL(BaseModel, utils.KwConfigClass):
         self.ds_smoothing = ds_smoothing
         self.ds_gaussians = ds_gaussians
         self.verbose = verbose
+        self.gaussian_maps_cache = {}
 
         # Initialize backbone CNN
         self.cnn = MobileNetV2(**self.cnn_cfg)
@@ -393,7 +394,12 @@ class UNISAL(BaseModel, utils.KwConfigClass):
 
     @staticmethod
     def _make_gaussian_maps(x, gaussians, size=None, scaling=6.0):
-        """Construct prior maps from Gaussian parameters."""
+        """
+        Construct prior maps from Gaussian parameters.
+
+        Patched: each map is separable, so it is computed as the outer product
+        of its per-axis Gaussians, for all Gaussians at once.
+        """
         if size is None:
             size = x.shape[-2:]
             bs = x.shape[0]
@@ -403,35 +409,46 @@ class UNISAL(BaseModel, utils.KwConfigClass):
         dtype = x.dtype
         device = x.device
 
-        gaussian_maps = []
-        map_template = torch.ones(*size, dtype=dtype, device=device)
-        meshgrids = torch.meshgrid(
-            [
-                torch.linspace(0, 1, size[0], dtype=dtype, device=device),
-                torch.linspace(0, 1, size[1], dtype=dtype, device=device),
-            ]
-        )
-
-        for gaussian_idx, yx_mu_logstd in enumerate(torch.unbind(gaussians)):
-            map = map_template.clone()
-            for mu_logstd, mgrid in zip(yx_mu_logstd, meshgrids):
-                mu = mu_logstd[0]
-                std = torch.exp(mu_logstd[1])
-                map *= torch.exp(-(((mgrid - mu) / std) ** 2) / 2)
+        gaussians = gaussians.to(dtype=dtype, device=device)
+        mu = gaussians[:, :, 0, None]
+        std = torch.exp(gaussians[:, :, 1, None])
+        grid_y = torch.linspace(0, 1, size[0], dtype=dtype, device=device)
+        grid_x = torch.linspace(0, 1, size[1], dtype=dtype, device=device)
+        gaussians_y = torch.exp(-(((grid_y - mu[:, 0]) / std[:, 0]) ** 2) / 2)
+        gaussians_x = torch.exp(-(((grid_x - mu[:, 1]) / std[:, 1]) ** 2) / 2)
 
-            map *= scaling
-            gaussian_maps.append(map)
-
-        gaussian_maps = torch.stack(gaussian_maps)
+        gaussian_maps = gaussians_y[:, :, None] * gaussians_x[:, None, :] * scaling
         gaussian_maps = gaussian_maps.unsqueeze(0).expand(bs, -1, -1, -1)
         return gaussian_maps
 
     def _get_gaussian_maps(self, x, source_str, prefix="coarse_", **kwargs):
-        """Return the constructed Gaussian prior maps."""
+        """
+        Return the constructed Gaussian prior maps.
+
+        Patched: the Gaussian parameters are fixed in eval mode, so the maps
+        are cached per (parameters, size, dtype, device) and only expanded
+        over the batch on later calls.
+        """
         suffix = source_str if self.ds_gaussians else ""
         gaussians = self.__getattr__(prefix + "gaussians" + suffix)
-        gaussian_maps = self._make_gaussian_maps(x, gaussians, **kwargs)
-        return gaussian_maps
+        if self.training:
+            return self._make_gaussian_maps(x, gaussians, **kwargs)
+        key = (prefix + suffix, tuple(x.shape[-2:]), kwargs.get("size"), x.dtype, x.device)
+        if key not in self.gaussian_maps_cache:
+            with torch.no_grad():
+                self.gaussian_maps_cache[key] = self._make_gaussian_maps(x[:1], gaussians, **kwargs)
+        bs = 1 if kwargs.get("size") is not None else x.shape[0]
+        return self.gaussian_maps_cache[key].expand(bs, -1, -1, -1)
+
+    def train(self, mode=True):
+        """Patched: clear the cached Gaussian prior maps when switching modes."""
+        self.gaussian_maps_cache = {}
+        return super().train(mode)
+
+    def load_state_dict(self, *args, **kwargs):
+        """Patched: clear the cached Gaussian prior maps when loading weights."""
+        self.gaussian_maps_cache = {}
+        return super().load_state_dict(*args, **kwargs)
 
     # @classmethod
     def make_skip_connection(
@@ -466,6 +483,55 @@ class UNISAL(BaseModel, utils.KwConfigClass):
             nn.ReLU6(inplace=True),
         )
 
+    def _encode(self, img, source_str):
+        """
+        Compute the backbone CNN features of a batch of frames, with the
+        Gaussian prior maps concatenated to the coarsest features.
+        """
+        im_feat_1x, im_feat_2x, im_feat_4x = self.cnn(img)
+
+        im_feat_2x = self.skip_2x(im_feat_2x)
+        im_feat_4x = self.skip_4x(im_feat_4x)
+
+        if self.n_gaussians > 0:
+            gaussian_maps = self._get_gaussian_maps(im_feat_1x, source_str)
+            im_feat_1x = torch.cat((im_feat_1x, gaussian_maps), dim=1)
+
+        im_feat_1x = self.post_cnn(im_feat_1x)
+        return im_feat_1x, im_feat_2x, im_feat_4x
+
+    def _decode(self, im_feat, feat_2x, feat_4x, source_str, input_size, target_size):
+        """
+        Decode the features of a batch of frames into log density saliency
+        maps of the target size.
+        """
+        im_feat = self.upsampling_1(im_feat)
+        im_feat = torch.cat((im_feat, feat_2x), dim=1)
+        im_feat = self.upsampling_2(im_feat)
+        # Patched: if an odd-numbered factor in the shape causes a mismatch in dimensions, cut the last index
+        if im_feat.shape[-2] > feat_4x.shape[-2]:
+            im_feat = im_feat[:, :, :-1, :]
+        im_feat = torch.cat((im_feat, feat_4x), dim=1)
+
+        im_feat = self.post_upsampling_2(im_feat)
+
+        im_feat = self.__getattr__(
+            "adaptation" + (source_str if self.ds_adaptation else "")
+        )(im_feat)
+
+        im_feat = F.interpolate(im_feat, size=input_size, mode="nearest")
+
+        im_feat = F.pad(im_feat, [self.smoothing_ksize // 2] * 4, mode="replicate")
+        im_feat = self.__getattr__(
+            "smoothing" + (source_str if self.ds_smoothing else "")
+        )(im_feat)
+
+        im_feat = F.interpolate(
+            im_feat, size=target_size, mode="bilinear", align_corners=False
+        )
+
+        return utils.log_softmax(im_feat)
+
     def forward(
         self,
         x,
@@ -498,37 +564,35 @@ class UNISAL(BaseModel, utils.KwConfigClass):
         if static is None:
             static = x.shape[1] == 1 or self.sources == ("SALICON",)
 
-        # Compute backbone CNN features and concatenate with Gaussian prior maps
-        feat_seq_1x = []
-        feat_seq_2x = []
-        feat_seq_4x = []
-        for t, img in enumerate(torch.unbind(x, dim=1)):
-            im_feat_1x, im_feat_2x, im_feat_4x = self.cnn(img)
-
-            im_feat_2x = self.skip_2x(im_feat_2x)
-            im_feat_4x = self.skip_4x(im_feat_4x)
-
-            if self.n_gaussians > 0:
-                gaussian_maps = self._get_gaussian_maps(im_feat_1x, source_str)
-                im_feat_1x = torch.cat((im_feat_1x, gaussian_maps), dim=1)
-
-            im_feat_1x = self.post_cnn(im_feat_1x)
-            feat_seq_1x.append(im_feat_1x)
-            feat_seq_2x.append(im_feat_2x)
-            feat_seq_4x.append(im_feat_4x)
-
-        feat_seq_1x = torch.stack(feat_seq_1x, dim=1)
+        # Patched: static inputs bypass the RNN, so every frame is independent.
+        # Fold time into the batch and run the encoder and decoder once.
+        if static and self.bypass_rnn:
+            batch_size, time_steps = x.shape[:2]
+            frames = x.flatten(0, 1)
+            im_feat_1x, im_feat_2x, im_feat_4x = self._encode(frames, source_str)
+            output = self._decode(
+                im_feat_1x, im_feat_2x, im_feat_4x, source_str, x.shape[-2:], target_size
+            )
+            output_seq = output.unflatten(0, (batch_size, time_steps))
+            hidden = None
+        else:
+            # Compute backbone CNN features and concatenate with Gaussian prior maps
+            feat_seq_1x = []
+            feat_seq_2x = []
+            feat_seq_4x = []
+            for t, img in enumerate(torch.unbind(x, dim=1)):
+                im_feat_1x, im_feat_2x, im_feat_4x = self._encode(img, source_str)
+                feat_seq_1x.append(im_feat_1x)
+                feat_seq_2x.append(im_feat_2x)
+                feat_seq_4x.append(im_feat_4x)
+
+            feat_seq_1x = torch.stack(feat_seq_1x, dim=1)
 
-        # Bypass-RNN
-        hidden, rnn_feat_seq, rnn_feat = (None,) * 3
-        if not (static and self.bypass_rnn):
             rnn_feat_seq, hidden = self.rnn(feat_seq_1x, hidden=h0)
 
-        # Decoder
-        output_seq = []
-        for idx, im_feat in enumerate(torch.unbind(feat_seq_1x, dim=1)):
-
-            if not (static and self.bypass_rnn):
+            # Decoder
+            output_seq = []
+            for idx, im_feat in enumerate(torch.unbind(feat_seq_1x, dim=1)):
                 rnn_feat = rnn_feat_seq[:, idx, ...]
                 rnn_feat = self.post_rnn(rnn_feat)
                 if self.res_rnn:
@@ -536,34 +600,17 @@ class UNISAL(BaseModel, utils.KwConfigClass):
                 else:
                     im_feat = rnn_feat
 
-            im_feat = self.upsampling_1(im_feat)
-            im_feat = torch.cat((im_feat, feat_seq_2x[idx]), dim=1)
-            im_feat = self.upsampling_2(im_feat)
-            # Patched: if an odd-numbered factor in the shape causes a mismatch in dimensions, cut the last index
-            if im_feat.shape[-2] > feat_seq_4x[idx].shape[-2]:
-                im_feat = im_feat[:, :, :-1, :]
-            im_feat = torch.cat((im_feat, feat_seq_4x[idx]), dim=1)
-
-            im_feat = self.post_upsampling_2(im_feat)
-
-            im_feat = self.__getattr__(
-                "adaptation" + (source_str if self.ds_adaptation else "")
-            )(im_feat)
-
-            im_feat = F.interpolate(im_feat, size=x.shape[-2:], mode="nearest")
-
-            im_feat = F.pad(im_feat, [self.smoothing_ksize // 2] * 4, mode="replicate")
-            im_feat = self.__getattr__(
-                "smoothing" + (source_str if self.ds_smoothing else "")
-            )(im_feat)
-
-            im_feat = F.interpolate(
-                im_feat, size=target_size, mode="bilinear", align_corners=False
-            )
-
-            im_feat = utils.log_softmax(im_feat)
-            output_seq.append(im_feat)
-        output_seq = torch.stack(output_seq, dim=1)
+                output_seq.append(
+                    self._decode(
+                        im_feat,
+                        feat_seq_2x[idx],
+                        feat_seq_4x[idx],
+                        source_str,
+                        x.shape[-2:],
+                        target_size,
+                    )
+                )
+            output_seq = torch.stack(output_seq, dim=1)
 
         outputs = [output_seq]
         if return_hidden: